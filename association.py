@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+
+# Association analysis that replaces .corr() on label encoded columns.
+# Nominal columns are compared through their contingency tables (Cramér's V or
+# mutual information), numeric columns with Pearson, and a numeric column with a
+# nominal one by the correlation ratio (eta). Everything is accumulated chunk by chunk
+# from the columns as they are (no copy of the frame, no encoded columns),
+# so the analysis of several years runs in the memory of one chunk.
+#
+#   association = AssociationAccumulator(nominal=["SEASON", "LAW_CLEAN"], numeric=["HOUR"])
+#   for chunk in chunks:
+#       association.update(chunk)
+#   association.association_matrix()
+
+
+class _Missing:
+    # the category of missing values (NaN, None) of every nominal column, a value of its own
+    # so it cannot be confused with a real "NaN" string in the data
+
+    def __repr__(self):
+        return "NaN"
+
+    __str__ = __repr__
+
+
+MISSING = _Missing()
+
+
+class AssociationAccumulator:
+
+    def __init__(self, nominal, numeric=()):
+        self.nominal = list(nominal)
+        self.numeric = list(numeric)
+        # nominal column -> {value: code}, codes are kept over all chunks (missing is a category too)
+        self.categories = {column: {} for column in self.nominal}
+        # (column a, column b) -> contingency table, rows = codes of a
+        self.tables = {}
+        # numeric sums are taken of x - shift (the first chunk's means), which keeps
+        # x^2 sums of e.g. years from cancelling out
+        self.shift = None
+        k = len(self.numeric)
+        self.pair_count = np.zeros((k, k))  # rows where both columns are present
+        self.pair_sum = np.zeros((k, k))  # sum of column i over those rows
+        self.pair_square = np.zeros((k, k))  # sum of column i^2 over those rows
+        self.pair_product = np.zeros((k, k))
+        # (nominal, numeric) -> per category count, sum and sum of squares of the numeric column
+        self.groups = {}
+        self.rows = 0
+
+    def _codes(self, series):
+        # global codes of the chunk's values
+        codes, uniques = pd.factorize(series, use_na_sentinel=False)
+        known = self.categories[series.name]
+        mapping = np.empty(len(uniques), dtype=np.int64)
+        for i, value in enumerate(uniques):
+            key = MISSING if pd.isna(value) else value
+            mapping[i] = known.setdefault(key, len(known))
+        return mapping[codes]
+
+    @staticmethod
+    def _grow(table, shape):
+        if table.shape == shape:
+            return table
+        return np.pad(table, [(0, new - old) for old, new in zip(table.shape, shape)])
+
+    def update(self, df):
+        self.rows += len(df)
+        codes = {column: self._codes(df[column]) for column in self.nominal}
+        sizes = {column: len(self.categories[column]) for column in self.nominal}
+
+        for i, a in enumerate(self.nominal):
+            for b in self.nominal[i + 1:]:
+                counts = np.bincount(codes[a] * sizes[b] + codes[b], minlength=sizes[a] * sizes[b])
+                table = self._grow(self.tables.get((a, b), np.zeros((0, 0), dtype=np.int64)), (sizes[a], sizes[b]))
+                self.tables[(a, b)] = table + counts.reshape(sizes[a], sizes[b])
+
+        if not self.numeric:
+            return
+        X = np.column_stack([pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=float)
+                             for column in self.numeric])
+        present = ~np.isnan(X)
+        if self.shift is None:
+            self.shift = np.array([column[~np.isnan(column)].mean() if (~np.isnan(column)).any() else 0.0
+                                   for column in X.T])
+        X = np.where(present, X - self.shift, 0.0)
+        mask = present.astype(float)
+        self.pair_count += mask.T @ mask
+        self.pair_sum += X.T @ mask
+        self.pair_square += (X * X).T @ mask
+        self.pair_product += X.T @ X
+
+        for a in self.nominal:
+            for j, b in enumerate(self.numeric):
+                rows = present[:, j]
+                group_codes = codes[a][rows]
+                x = X[rows, j]
+                stats = np.vstack([
+                    np.bincount(group_codes, minlength=sizes[a]),
+                    np.bincount(group_codes, weights=x, minlength=sizes[a]),
+                    np.bincount(group_codes, weights=x * x, minlength=sizes[a]),
+                ])
+                previous = self._grow(self.groups.get((a, b), np.zeros((3, 0))), (3, sizes[a]))
+                self.groups[(a, b)] = previous + stats
+
+    # --- statistics ---
+
+    def contingency_table(self, a, b):
+        # the counts as a labelled frame
+        table = self.tables[(a, b)] if (a, b) in self.tables else self.tables[(b, a)].T
+        return pd.DataFrame(table, index=list(self.categories[a])[:table.shape[0]],
+                            columns=list(self.categories[b])[:table.shape[1]])
+
+    def _table(self, a, b):
+        table = self.tables[(a, b)] if (a, b) in self.tables else self.tables[(b, a)].T
+        # categories that never occur together with the other column's rows
+        table = table[table.sum(axis=1) > 0][:, table.sum(axis=0) > 0]
+        return table.astype(float)
+
+    def cramers_v(self, a, b, bias_correction=False):
+        table = self._table(a, b)
+        n = table.sum()
+        r, k = table.shape
+        if n == 0 or min(r, k) < 2:
+            return 0.0
+        expected = table.sum(axis=1, keepdims=True) * table.sum(axis=0, keepdims=True) / n
+        phi2 = ((table - expected) ** 2 / expected).sum() / n
+        if bias_correction:
+            # Bergsma (2013), keeps many categories from inflating V
+            phi2 = max(0.0, phi2 - (k - 1) * (r - 1) / (n - 1))
+            r = r - (r - 1) ** 2 / (n - 1)
+            k = k - (k - 1) ** 2 / (n - 1)
+            if min(r, k) <= 1:
+                return 0.0
+        return float(np.sqrt(phi2 / (min(r, k) - 1)))
+
+    def mutual_information(self, a, b, normalized=True):
+        # in nats, normalized by sqrt(H(a) H(b)) to 0..1
+        table = self._table(a, b)
+        n = table.sum()
+        if n == 0:
+            return 0.0
+        p = table / n
+        pa = p.sum(axis=1, keepdims=True)
+        pb = p.sum(axis=0, keepdims=True)
+        nonzero = p > 0
+        mi = float((p[nonzero] * np.log(p[nonzero] / (pa @ pb)[nonzero])).sum())
+        if not normalized:
+            return mi
+        entropy_a = -float((pa[pa > 0] * np.log(pa[pa > 0])).sum())
+        entropy_b = -float((pb[pb > 0] * np.log(pb[pb > 0])).sum())
+        return mi / np.sqrt(entropy_a * entropy_b) if entropy_a > 0 and entropy_b > 0 else 0.0
+
+    def pearson(self):
+        # pairwise complete Pearson correlations of the numeric columns
+        n = self.pair_count
+        sum_i, sum_j = self.pair_sum, self.pair_sum.T
+        square_i, square_j = self.pair_square, self.pair_square.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            covariance = n * self.pair_product - sum_i * sum_j
+            variance = (n * square_i - sum_i ** 2) * (n * square_j - sum_j ** 2)
+            r = covariance / np.sqrt(variance)
+        r = np.clip(r, -1, 1)
+        # a constant column (the year of one file) has no correlation, not even with itself
+        np.fill_diagonal(r, np.where(np.diag(variance) > 0, 1.0, np.nan))
+        return pd.DataFrame(r, index=self.numeric, columns=self.numeric)
+
+    def correlation_ratio(self, nominal, numeric):
+        # eta: how much of the numeric column's variance the categories explain (0..1),
+        # NaN for a constant numeric column like pearson()
+        count, total, square = self.groups[(nominal, numeric)]
+        n = count.sum()
+        if n == 0:
+            return np.nan
+        between = (total[count > 0] ** 2 / count[count > 0]).sum() - total.sum() ** 2 / n
+        within_total = square.sum() - total.sum() ** 2 / n
+        return float(np.sqrt(max(0.0, between) / within_total)) if within_total > 1e-9 * square.sum() else np.nan
+
+    def association_matrix(self, method="cramers_v", bias_correction=True):
+        # all columns against each other: nominal-nominal by method ("cramers_v" or
+        # "mutual_information"), numeric-numeric Pearson, nominal-numeric eta
+        columns = self.nominal + self.numeric
+        matrix = pd.DataFrame(np.eye(len(columns)), index=columns, columns=columns)
+        for i, a in enumerate(self.nominal):
+            for b in self.nominal[i + 1:]:
+                if method == "mutual_information":
+                    value = self.mutual_information(a, b)
+                else:
+                    value = self.cramers_v(a, b, bias_correction)
+                matrix.loc[a, b] = matrix.loc[b, a] = value
+        if self.numeric:
+            matrix.loc[self.numeric, self.numeric] = self.pearson().to_numpy()
+            for a in self.nominal:
+                for b in self.numeric:
+                    matrix.loc[a, b] = matrix.loc[b, a] = self.correlation_ratio(a, b)
+        return matrix
+
+
+def association_matrix(df, nominal, numeric=(), method="cramers_v", bias_correction=True):
+    # one-shot version for a frame in memory
+    accumulator = AssociationAccumulator(nominal, numeric)
+    accumulator.update(df)
+    return accumulator.association_matrix(method, bias_correction)
@@ -0,0 +1,212 @@
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import contextlib
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import data_process as dp
+from data_process import process_data
+from raw_loader import read_raw
+
+# Benchmarks of the preprocessing and inference hot paths.
+# The input is the source file resampled (with replacement) to every size,
+# each benchmark reports the best time of a few runs as rows per second,
+# and the peak memory of one extra run under tracemalloc (tracing slows the code
+# down, so it is not part of the timed runs).
+#
+#   python bench_pipeline.py --source MHMP_dopravni_prestupky_2023.csv --json bench.json
+#   python bench_pipeline.py --sizes 100000 --baseline bench_baseline.json   # exit code 1 on a regression
+#   python bench_pipeline.py --source synthetic   # generate_mhmp.py data instead of a real file
+
+
+def _months(raw):
+    return pd.to_datetime(raw["DATSK"]).dt.month
+
+
+def _hours(raw):
+    return pd.to_datetime(raw["CASSK"], format="mixed", errors="coerce").dt.hour.fillna(-1).astype(int)
+
+
+def _quiet(func, *args, **kwargs):
+    # complex_data_analysis prints its progress
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def _legacy_dummies(clean, model_columns):
+    # the encoding predict.py did before FeatureEncoder
+    X = pd.get_dummies(clean.drop(columns=["OZNAM"], errors="ignore"), drop_first=True)
+    return X.reindex(columns=model_columns, fill_value=0)
+
+
+def make_benchmarks(model):
+    # name -> (setup(raw, clean) -> argument, run(argument));
+    # setup is not timed, it runs again before every run
+    from comprehensice_data_processing import complex_data_analysis
+
+    benchmarks = {
+        "get_season_vec": (lambda raw, clean: _months(raw), dp.get_season_vec),
+        "get_day_time_vec": (lambda raw, clean: _hours(raw), dp.get_day_time_vec),
+        "get_country": (lambda raw, clean: raw["MPZ"], dp.get_country),
+        # the free text features, parsed once per distinct value
+        "get_prague_district": (lambda raw, clean: raw["PRAHA"],
+                                lambda series: dp.categorical_apply(series, dp.get_prague_district)),
+        "get_place_type": (lambda raw, clean: raw["MISTOSK"],
+                           lambda series: dp.categorical_apply(series, dp.get_place_type)),
+        "extract_car_brand": (lambda raw, clean: raw["TOVZN"],
+                              lambda series: dp.categorical_apply(series, dp.extract_car_brand)),
+        "get_law": (lambda raw, clean: raw["PRAVFOR"], lambda series: dp.categorical_apply(series, dp.get_law)),
+        "process_data": (lambda raw, clean: raw, process_data),
+        # complex_data_analysis writes into its input, so every run gets a copy
+        # (with plain string columns, as comprehensice_data_processing reads them)
+        "complex_data_analysis": (
+            lambda raw, clean: raw.astype(object),
+            lambda df: _quiet(complex_data_analysis, df, show_plot=False)
+        ),
+    }
+    if model is not None:
+        benchmarks.update({
+            "encode_get_dummies": (lambda raw, clean: clean, lambda df: _legacy_dummies(df, model.model_columns)),
+            "encode_feature_encoder": (lambda raw, clean: clean, model.encode),
+            "mlp_inference": (lambda raw, clean: model.encode(clean), model.engine.predict),
+            "predict_end_to_end": (lambda raw, clean: clean, model.predict),
+            # the PredictionTable path: empty table every run, and one kept between the runs
+            "predict_lookup_cold": (lambda raw, clean: clean, lambda df: _table_model(model).predict(df)),
+            "predict_lookup_warm": (lambda raw, clean: clean, _table_model(model).predict),
+        })
+    return benchmarks
+
+
+def _table_model(model):
+    # the same engine with its own, empty PredictionTable
+    from inference import Model
+    table_model = Model(model.engine, model.encoder, model.class_names, model.schema, model.dtype)
+    table_model.use_table()
+    return table_model
+
+
+def measure(setup, run, raw, clean, repeat=3, memory=True):
+    times = []
+    for _ in range(repeat):
+        argument = setup(raw, clean)
+        start = time.perf_counter()
+        run(argument)
+        times.append(time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        argument = setup(raw, clean)
+        tracemalloc.start()
+        run(argument)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def make_raw(source, rows, seed=0):
+    return source.sample(rows, replace=True, random_state=seed).reset_index(drop=True)
+
+
+def run_benchmarks(source, sizes, only=None, repeat=3, memory=True, model=None):
+    benchmarks = make_benchmarks(model)
+    if only:
+        benchmarks = {name: bench for name, bench in benchmarks.items() if any(part in name for part in only)}
+
+    results = []
+    for rows in sizes:
+        raw = make_raw(source, rows)
+        clean = process_data(raw)
+        for name, (setup, run) in benchmarks.items():
+            seconds, peak = measure(setup, run, raw, clean, repeat, memory)
+            result = {
+                "benchmark": name,
+                "rows": rows,
+                "seconds": seconds,
+                "rows_per_second": rows / seconds if seconds else float("inf"),
+                "peak_mb": peak / 2**20 if peak is not None else None,
+            }
+            results.append(result)
+            peak_text = f"{result['peak_mb']:9.1f} MB" if peak is not None else ""
+            print(f"{name:<24} {rows:>10} rows  {seconds:8.3f} s  {result['rows_per_second']:>12,.0f} rows/s {peak_text}")
+        del raw, clean
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=0.2):
+    # (benchmark, rows, baseline rows/s, current rows/s) of everything slower than the
+    # baseline by more than tolerance
+    previous = {(result["benchmark"], result["rows"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get((result["benchmark"], result["rows"]))
+        if old and result["rows_per_second"] < old["rows_per_second"] * (1 - tolerance):
+            regressions.append((result["benchmark"], result["rows"], old["rows_per_second"], result["rows_per_second"]))
+    return regressions
+
+
+def load_model(model_dir):
+    from inference import Model
+    try:
+        return Model.load(model_dir)
+    except FileNotFoundError:
+        print(f"no model in {model_dir}, the encoding and inference benchmarks are skipped")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks of preprocessing and inference")
+    parser.add_argument("--source", default="MHMP_dopravni_prestupky_2023.csv",
+                        help="raw MHMP csv resampled to every size, or 'synthetic'")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--only", nargs="+", default=None, help="benchmarks whose name contains one of these")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--model-dir", default=".")
+    parser.add_argument("--json", default=None, help="write the results here")
+    parser.add_argument("--baseline", default=None, help="results JSON of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    if args.source == "synthetic":
+        from generate_mhmp import generate_frame, default_profile
+        source = generate_frame(default_profile(), 200_000, np.random.default_rng(0))
+    else:
+        source = read_raw(args.source)
+    results = run_benchmarks(source, args.sizes, args.only, args.repeat, not args.no_memory,
+                             load_model(args.model_dir))
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "source": args.source,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_with_baseline(results, json.load(file), args.tolerance)
+        for name, rows, old, new in regressions:
+            print(f"REGRESSION {name} at {rows} rows: {old:,.0f} -> {new:,.0f} rows/s")
+        if regressions:
+            return 1
+        print("no regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+import time
+
+# Startup time of the command line entry point.
+# Every command runs in a fresh interpreter several times, the median wall time
+# is compared with a budget (exit code 1 when a command is over it).
+# The scoring command runs on a few rows built from the model vocabulary,
+# so the time is mostly interpreter start, imports and model loading.
+#
+#   python bench_startup.py --repeat 5 --budget 1.5 --json startup.json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_tiny_dataset(path, model_dir=HERE, rows=10):
+    # a cleaned .npz with a few rows of known categories
+    from clean_store import save_clean
+    from inference import Model
+    import pandas as pd
+
+    encoder = Model.load(model_dir).encoder
+    record = {feature: next(iter(mapping)) for feature, mapping in encoder.categories.items()}
+    record.update({feature: 0 for feature in encoder.numeric})
+    df = pd.DataFrame([record] * rows)
+    df["OZNAM"] = "MPP"
+    save_clean(df, path)
+
+
+def time_command(command, repeat, cwd):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_profile(command, cwd, top=10):
+    # the most expensive top level imports (cumulative microseconds from python -X importtime)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + command[1:], cwd=cwd,
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit() or name.startswith("  "):
+            continue  # header or a nested import
+        imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="startup time of cli.py")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.5, help="seconds allowed for the median predict run")
+    parser.add_argument("--model-dir", default=HERE)
+    parser.add_argument("--json", default=None, help="write the results here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.path.join(tmp, "tiny_clean.npz")
+        make_tiny_dataset(data, args.model_dir)
+        errors = os.path.join(tmp, "errors.csv")
+        cli = os.path.join(HERE, "cli.py")
+        commands = {
+            "python": [sys.executable, "-c", "pass"],
+            "cli --help": [sys.executable, cli, "--help"],
+            "cli predict": [sys.executable, cli, "predict", data, "--model-dir", args.model_dir, "--errors", errors],
+        }
+
+        results = {}
+        for name, command in commands.items():
+            times = time_command(command, args.repeat, tmp)
+            results[name] = {"median": statistics.median(times), "min": min(times), "runs": times}
+            print(f"{name:<12} median {results[name]['median']:.3f} s   min {results[name]['min']:.3f} s")
+
+        print("\nslowest top level imports of cli predict:")
+        for cumulative, module in import_profile(commands["cli predict"], tmp):
+            print(f"  {cumulative / 1e6:6.3f} s  {module}")
+
+    over_budget = results["cli predict"]["median"] > args.budget
+    results["budget"] = args.budget
+    results["over_budget"] = over_budget
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=1)
+    print(f"\nbudget {args.budget:.2f} s: {'OVER' if over_budget else 'ok'}")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import json
+import struct
+import zipfile
+import numpy as np
+import pandas as pd
+
+from data_process import FEATURES_FINGERPRINT
+
+# Cleaned datasets stored as one .npz file instead of 20xx_clean.csv.
+# Text columns are kept as category codes plus their category list,
+# numeric columns as they are. np.load reads the members lazily,
+# so loading only some columns reads only their arrays. np.savez stores the members
+# uncompressed, iter_clean_chunks maps them (mmap) and reads one chunk at a time.
+
+STORE_FORMAT = 1
+
+
+def _smallest_int(n):
+    # the smallest signed int type for codes 0..n-1 (and -1 for missing)
+    for dtype in (np.int8, np.int16, np.int32):
+        if n < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def save_clean(df, path, pipeline_version=FEATURES_FINGERPRINT):
+    arrays = {}
+    columns = []
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_bool_dtype(column):
+            arrays[f"{name}.values"] = column.to_numpy()
+            columns.append({"name": name, "kind": "numeric", "dtype": str(column.dtype)})
+        else:
+            categorical = pd.Categorical(column)
+            categories = categorical.categories.to_numpy()
+            arrays[f"{name}.codes"] = categorical.codes.astype(_smallest_int(len(categories)))
+            arrays[f"{name}.categories"] = categories.astype(str)
+            columns.append({"name": name, "kind": "category"})
+
+    # the index is only stored when it is not the default 0..n-1
+    default_index = isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1
+    if not default_index:
+        index_values = df.index.to_numpy()
+        arrays["__index__"] = index_values.astype(str) if index_values.dtype == object else index_values
+
+    meta = {
+        "format": STORE_FORMAT,
+        "pipeline_version": pipeline_version,
+        "rows": len(df),
+        "columns": columns,
+        "index_name": df.index.name,
+    }
+    arrays["__meta__"] = np.array(json.dumps(meta))
+    np.savez(path, **arrays)
+
+
+def read_clean_metadata(path):
+    with np.load(path) as data:
+        return json.loads(data["__meta__"].item())
+
+
+def load_clean(path, columns=None, pipeline_version=None):
+    # columns: list of columns to read (all if None)
+    # pipeline_version: if given, a file written by other feature code is refused
+    with np.load(path) as data:
+        meta = json.loads(data["__meta__"].item())
+        if pipeline_version is not None and meta["pipeline_version"] != pipeline_version:
+            raise ValueError(
+                f"{path} was written by pipeline version {meta['pipeline_version']}, "
+                f"expected {pipeline_version}"
+            )
+
+        stored = {column["name"]: column for column in meta["columns"]}
+        wanted = list(stored) if columns is None else list(columns)
+        missing = [name for name in wanted if name not in stored]
+        if missing:
+            raise KeyError(f"columns {missing} are not in {path}")
+
+        if "__index__" in data.files:
+            index = pd.Index(data["__index__"], name=meta["index_name"])
+        else:
+            index = pd.RangeIndex(meta["rows"], name=meta["index_name"])
+
+        result = {}
+        for name in wanted:
+            if stored[name]["kind"] == "numeric":
+                result[name] = data[f"{name}.values"]
+            else:
+                result[name] = pd.Categorical.from_codes(
+                    data[f"{name}.codes"], categories=data[f"{name}.categories"].astype(object)
+                )
+        return pd.DataFrame(result, index=index)
+
+
+def _map_member(path, archive, name):
+    # a stored (uncompressed) .npy member of the npz as a read-only memmap,
+    # read completely if it is compressed
+    info = archive.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        with archive.open(info) as member:
+            return np.lib.format.read_array(member)
+    with open(path, "rb") as file:
+        # the member's data follows its local header: 30 bytes, the file name and the extra field
+        file.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", file.read(4))
+        file.seek(info.header_offset + 30 + name_length + extra_length)
+        if np.lib.format.read_magic(file) == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+    if dtype.hasobject:
+        raise ValueError(f"{name} in {path} is an object array")
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                     order="F" if fortran_order else "C")
+
+
+def iter_clean_chunks(path, chunk_rows=500_000, columns=None):
+    # the stored dataset in row chunks; the value / code arrays are mapped and sliced,
+    # so only the rows of the current chunk are read into memory
+    meta = read_clean_metadata(path)
+    stored = {column["name"]: column for column in meta["columns"]}
+    wanted = list(stored) if columns is None else list(columns)
+    missing = [name for name in wanted if name not in stored]
+    if missing:
+        raise KeyError(f"columns {missing} are not in {path}")
+
+    with zipfile.ZipFile(path) as archive:
+        arrays = {}
+        categories = {}
+        for name in wanted:
+            if stored[name]["kind"] == "numeric":
+                arrays[name] = _map_member(path, archive, f"{name}.values")
+            else:
+                arrays[name] = _map_member(path, archive, f"{name}.codes")
+                with archive.open(f"{name}.categories.npy") as member:
+                    categories[name] = pd.Index(np.lib.format.read_array(member).astype(object))
+        index = None
+        if "__index__.npy" in archive.namelist():
+            with archive.open("__index__.npy") as member:
+                index = np.lib.format.read_array(member)
+
+    for start in range(0, meta["rows"], chunk_rows):
+        stop = min(start + chunk_rows, meta["rows"])
+        result = {}
+        for name in wanted:
+            values = np.array(arrays[name][start:stop])
+            if name in categories:
+                values = pd.Categorical.from_codes(values, categories=categories[name])
+            result[name] = values
+        if index is None:
+            chunk_index = pd.RangeIndex(start, stop, name=meta["index_name"])
+        else:
+            chunk_index = pd.Index(index[start:stop], name=meta["index_name"])
+        yield pd.DataFrame(result, index=chunk_index)
+
+
+if __name__ == "__main__":
+    # converts an old cleaned CSV, e.g. python clean_store.py 2020_clean.csv
+    import sys
+
+    for csv_path in sys.argv[1:]:
+        df_csv = pd.read_csv(csv_path, index_col=0)
+        out_path = csv_path.rsplit(".", 1)[0] + ".npz"
+        # the code that wrote the CSV is not known
+        save_clean(df_csv, out_path, pipeline_version=None)
+        print(f"{csv_path} -> {out_path}")
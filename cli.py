@@ -0,0 +1,178 @@
+import sys
+import argparse
+
+# One entry point for the whole pipeline:
+#
+#   python cli.py preprocess MHMP_dopravni_prestupky_2023.csv -o 2023_clean.npz
+#   python cli.py train MHMP_dopravni_prestupky_2023.csv --no-plot
+#   python cli.py train MHMP_dopravni_prestupky_20*.csv --incremental
+#   python cli.py predict 2020_clean.npz
+#   python cli.py analyze MHMP_dopravni_prestupky_2024.csv --no-plot
+#   python cli.py analyze MHMP_dopravni_prestupky_20*.csv --chunksize 500000 -o associations.csv
+#   python cli.py sweep MHMP_dopravni_prestupky_2023.csv --layers 50,25 100 --alpha 1e-4 1e-3
+#   python cli.py --profile trace.jsonl predict 2020_clean.npz   (see profiling.py)
+#
+# Only argparse is imported up front, every subcommand imports what it needs
+# when it runs (pandas, sklearn, the plotting libraries, ...),
+# so a scoring run does not pay for training or plotting code.
+
+
+def run_preprocess(args):
+    from clean_store import save_clean
+
+    if len(args.inputs) == 1 and args.workers == 1:
+        import pandas as pd
+        from data_process import iter_processed_chunks, FeatureCache
+
+        cache = FeatureCache(args.cache) if args.cache else None
+        chunks = iter_processed_chunks(args.inputs[0], args.chunksize, cache)
+        if args.balance is None:
+            df_clean = pd.concat(chunks)
+        else:
+            # only the balanced sample is kept in memory
+            from sampling import sample_chunks, count_labels
+            df_clean = sample_chunks(chunks, count_labels(args.inputs[0]), ratio=args.balance, seed=args.seed)
+        if cache is not None:
+            cache.save()
+    else:
+        from parallel_process import process_files_parallel
+        df_clean = process_files_parallel(args.inputs, args.workers, args.chunksize, args.cache)
+        if args.balance is not None:
+            from sampling import sample_frame
+            df_clean = sample_frame(df_clean, ratio=args.balance, seed=args.seed, keys=df_clean.index)
+
+    if args.output.endswith(".npz"):
+        save_clean(df_clean, args.output)
+    else:
+        df_clean.to_csv(args.output)
+    print(f"{len(df_clean)} rows -> {args.output}")
+
+
+def run_train(args):
+    import train
+    if args.incremental and args.dedup:
+        raise SystemExit("--dedup is for training in memory, not with --incremental")
+    if args.incremental:
+        train.main_incremental(args.data, args.cache, args.epochs, args.chunksize, args.balance)
+    elif len(args.data) > 1:
+        raise SystemExit("training on several files needs --incremental")
+    else:
+        train.main(args.data[0], args.cache, show_plot=not args.no_plot, balance=args.balance, dedup=args.dedup)
+
+
+def run_predict(args):
+    import predict
+    predict.main(args.data, args.model_dir, args.chunk_rows, args.errors, args.store, not args.no_lookup)
+
+
+def run_analyze(args):
+    if args.explore:
+        # cleaning, association matrices and class balancing of main.py
+        import main
+        main.main(args.data[0], args.output or "data_clean.npz", show_plot=not args.no_plot)
+        return
+
+    if args.chunksize or len(args.data) > 1:
+        # only the association matrix, accumulated chunk by chunk over all the files
+        from comprehensice_data_processing import chunked_association_analysis
+        matrix = chunked_association_analysis(args.data, args.chunksize or 500_000, show_plot=not args.no_plot)
+        print(matrix.round(3).to_string())
+        if args.output:
+            matrix.to_csv(args.output)
+        return
+
+    from comprehensice_data_processing import complex_data_analysis, read_analysis_csv
+    df_final = complex_data_analysis(read_analysis_csv(args.data[0]), show_plot=not args.no_plot)
+    if args.output:
+        from clean_store import save_clean
+        save_clean(df_final, args.output)
+        print(f"{len(df_final)} rows -> {args.output}")
+
+
+def run_sweep(args):
+    import sweep
+    parser = argparse.ArgumentParser(prog="cli.py sweep", description="parallel hyperparameter sweep of the MLP")
+    sweep.add_arguments(parser)
+    sweep.run(parser.parse_args(args.sweep_args))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="MHMP traffic offences: MPP / PČR classifier")
+    parser.add_argument("--profile", nargs="?", const="profile_trace.jsonl", default=None, metavar="TRACE",
+                        help="record per stage times to a JSONL trace (also MHMP_PROFILE=path)")
+    parser.add_argument("--profile-memory", action="store_true", help="also record peak allocations (slower)")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    preprocess = subcommands.add_parser("preprocess", help="clean raw MHMP files")
+    preprocess.add_argument("inputs", nargs="+", help="MHMP_dopravni_prestupky_20xx.csv files")
+    preprocess.add_argument("-o", "--output", required=True, help="cleaned output, .npz or .csv")
+    preprocess.add_argument("--workers", type=int, default=1, help="processes (more than 1 runs parallel_process)")
+    preprocess.add_argument("--chunksize", type=int, default=500_000, help="rows per chunk / shard")
+    preprocess.add_argument("--cache", default="feature_cache.pkl", help="feature cache, empty for none")
+    preprocess.add_argument("--balance", nargs="?", type=float, const=1.0, default=None, metavar="RATIO",
+                            help="downsample the classes to at most RATIO : 1 (1 without a value)")
+    preprocess.add_argument("--seed", type=int, default=42, help="seed of --balance")
+    preprocess.set_defaults(run=run_preprocess)
+
+    train = subcommands.add_parser("train", help="train the MLP and export the model")
+    train.add_argument("data", nargs="*", default=["MHMP_dopravni_prestupky_2023.csv"],
+                       help="raw MHMP csv or cleaned .npz (several raw files with --incremental)")
+    train.add_argument("--cache", default="feature_cache.pkl")
+    train.add_argument("--no-plot", action="store_true", help="no confusion matrix window")
+    train.add_argument("--incremental", action="store_true",
+                       help="out of core training with partial_fit over all the given files")
+    train.add_argument("--epochs", type=int, default=10, help="epochs of --incremental")
+    train.add_argument("--chunksize", type=int, default=500_000, help="rows per chunk of --incremental")
+    train.add_argument("--dedup", action="store_true",
+                       help="train on the unique rows weighted by their counts (not with --incremental)")
+    train.add_argument("--balance", nargs="?", type=float, const=1.0, default=None, metavar="RATIO",
+                       help="downsample the classes to at most RATIO : 1 before training (1 without a value)")
+    train.set_defaults(run=run_train)
+
+    predict = subcommands.add_parser("predict", help="score a dataset and print the evaluation")
+    predict.add_argument("data", nargs="?", default="2020_clean.npz", help="cleaned .npz or raw MHMP csv")
+    predict.add_argument("--model-dir", default=".")
+    predict.add_argument("--chunk-rows", type=int, default=500_000)
+    predict.add_argument("--errors", default="model_errors.csv", help="where misclassified rows go")
+    predict.add_argument("--store", default="feature_store",
+                         help="feature store of raw csv input (only new rows are processed), empty for none")
+    predict.add_argument("--no-lookup", action="store_true",
+                         help="every row through the MLP instead of the table of feature combinations")
+    predict.set_defaults(run=run_predict)
+
+    analyze = subcommands.add_parser("analyze", help="association analysis of raw MHMP files")
+    analyze.add_argument("data", nargs="*", default=["MHMP_dopravni_prestupky_2023.csv"],
+                         help="raw MHMP csv (several files are analyzed chunk by chunk)")
+    analyze.add_argument("--explore", action="store_true",
+                         help="the main.py exploration (cleaning, balancing, three matrices)")
+    analyze.add_argument("--chunksize", type=int, default=None,
+                         help="read in chunks and compute only the association matrix")
+    analyze.add_argument("-o", "--output", default=None,
+                         help="save the resulting frame as .npz (data_clean.npz with --explore, "
+                              "the matrix as csv with --chunksize)")
+    analyze.add_argument("--no-plot", action="store_true")
+    analyze.set_defaults(run=run_analyze)
+
+    # the options are defined in sweep.py, everything after "sweep" goes there
+    sweep = subcommands.add_parser("sweep", help="parallel hyperparameter sweep (see sweep.py --help)",
+                                   add_help=False)
+    sweep.add_argument("sweep_args", nargs=argparse.REMAINDER)
+    sweep.set_defaults(run=run_sweep)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, unknown = parser.parse_known_args(argv)
+    if args.command == "sweep":
+        args.sweep_args = unknown + args.sweep_args
+    elif unknown:
+        parser.error(f"unrecognized arguments: {' '.join(unknown)}")
+    if args.profile:
+        import profiling
+        profiling.enable(args.profile, args.profile_memory)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
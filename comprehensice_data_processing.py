@@ -1,8 +1,7 @@
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import re
+import profiling
+from raw_loader import read_raw
+from time_parser import parse_dates, parse_hours, month_numbers, years, weekdays
+from law_parser import parse_citation
 
 # --- KONFIGURACE A KONSTANTY ---
 
@@ -103,56 +102,39 @@ def get_prague_district(n):
 
 
 def get_law(text):
-    """Parsuje porušený zákon (paragraf/odstavec/písmeno)."""
-    if not isinstance(text, str):
-        return "OTHER"
-
-    text = text.lower().strip()
-
-    # Hledání paragrafu (např. 125c)
-    paragraph_match = re.search(r'(?:§\s*|^)?(\d+[a-z]?)', text)
-    if not paragraph_match:
+    """Parsuje porušený zákon (paragraf/písmeno), části citace dává law_parser."""
+    parts = parse_citation(text)
+    if parts is None or not parts["paragraph"]:
         return "OTHER"
 
-    result = paragraph_match.group(1)
-
-    # Hledání písmene v závorce
-    char_match = re.search(r'([a-z])\)', text)
-    if char_match:
-        result += f"/{char_match.group(1)}"
+    # Paragraf (např. 125c) a písmeno v závorce
+    result = parts["paragraph"]
+    if parts["bracket_letter"]:
+        result += f"/{parts['bracket_letter']}"
 
     return result
 
 
-def encode_column_for_corr(series):
-    """
-    Jednoduchý Label Encoding pro účely korelační matice.
-    """
-    series = series.astype(str)
-    labels, uniques = pd.factorize(series)
-    return labels, uniques
-
-
-# --- HLAVNÍ FUNKCE ---
-
-def complex_data_analysis(df, show_plot=True):
-
-    print("Zpracovávám data...")
+# Sloupce asociační matice: nominální se porovnávají přes kontingenční tabulky (Cramérovo V),
+# číselné Pearsonem, dvojice nominální/číselný poměrem korelace eta (viz association.py)
+ASSOCIATION_NOMINAL = [
+    "SEASON", "DAY_TIME", "PRAGUE", "PLACE_TYPE", "COUNTRY", "CAR_TYPE", "LAW_CLEAN", "WHO_RAW"
+]
+ASSOCIATION_NUMERIC = ["YEAR", "MONTH_NUM", "HOUR", "WORKDAY", "IS_FIRM"]
 
-    # 2. ZÁKLADNÍ ZPRACOVÁNÍ (IDENTICKÉ S data_process.py)
-    # Musíme dodržet přesný postup, aby seděly typy a hodnoty
 
-    # Čas
-    df["DATSK"] = pd.to_datetime(df["DATSK"])
-    # Použijeme format='mixed' a coerce, stejně jako v data_process
-    temp_times = pd.to_datetime(df['CASSK'], format='mixed', errors='coerce')
+def add_analysis_columns(df):
+    """Doplní do df (na místě) příznaky pro trénink i sloupce navíc pro asociační matici."""
+    # Čas: stejný parser jako v data_process (jen unikátní hodnoty, pevné pozice znaků)
+    dates = parse_dates(df["DATSK"])
+    df["DATSK"] = dates
 
     # Základní features vyžadované pro trénink
-    df["MONTH_NUM"] = df["DATSK"].dt.month
+    df["MONTH_NUM"] = month_numbers(dates)
     df["SEASON"] = df["MONTH_NUM"].apply(get_season)
 
-    # Hodina: fillna(-1) a int, přesně jako v data_process
-    df["HOUR"] = temp_times.dt.hour.fillna(-1).astype(int)
+    # Hodina: -1 pro chybějící čas, přesně jako v data_process
+    df["HOUR"] = parse_hours(df["CASSK"])
     df["DAY_TIME"] = df["HOUR"].apply(get_day_time)
 
     df["PRAGUE"] = df["PRAHA"].apply(get_prague_district)
@@ -162,70 +144,110 @@ def complex_data_analysis(df, show_plot=True):
     df["IS_FIRM"] = (df["FIRMA"] == "ANO").astype(int)
 
     # 3. ROZŠÍŘENÁ ANALÝZA (NAVÍC OPROTI data_process.py)
-    # Vytváříme sloupce navíc pouze pro účely korelační matice.
+    # Vytváříme sloupce navíc pouze pro účely asociační matice.
     # Tyto sloupce nebudou ve finálním výstupu pro model.
 
-    df["YEAR"] = df["DATSK"].dt.year
-    df["WEEKDAY"] = df["DATSK"].dt.weekday
+    df["YEAR"] = years(dates)
+    df["WEEKDAY"] = weekdays(dates)
     df["WORKDAY"] = df["WEEKDAY"].apply(is_workday)
 
-    # Očištění země původu (jen pro korelaci, v raw datech necháváme původní)
+    # Očištění země původu (jen pro asociace, v raw datech necháváme původní)
     df["COUNTRY"] = df["MPZ"].fillna("UNKNOWN")
 
     if "OZNAM" in df.columns:
         df["WHO_RAW"] = df["OZNAM"]
+    return df
+
+
+def association_accumulator(columns):
+    """Akumulátor asociací pro sloupce, které data opravdu mají."""
+    from association import AssociationAccumulator
+
+    return AssociationAccumulator(
+        nominal=[c for c in ASSOCIATION_NOMINAL if c in columns],
+        numeric=[c for c in ASSOCIATION_NUMERIC if c in columns],
+    )
+
+
+def plot_association_matrix(matrix, path="correlation_matrix.png"):
+    # Knihovny pro grafy se načítají jen při vykreslování
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.figure(figsize=(14, 12))
+    sns.heatmap(
+        matrix,
+        annot=True,
+        fmt=".2f",
+        cmap='coolwarm',
+        vmin=-1,
+        vmax=1,
+        annot_kws={"size": 14}  # Zvětšení písma hodnot v matici
+    )
+    plt.title("Asociační matice: Všechny extrahované příznaky", fontsize=20)  # Zvětšení nadpisu
+    plt.xticks(fontsize=14, rotation=45)  # Zvětšení a natočení popisků osy X
+    plt.yticks(fontsize=14, rotation=0)  # Zvětšení popisků osy Y
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.show()
+
+
+def read_analysis_csv(path, chunksize=None):
+    """Načte jen potřebné sloupce MHMP exportu a zkontroluje hlavičku.
+
+    Sloupce zůstávají jako řetězce (ne kategorie), .apply a fillna níže s nimi počítají.
+    """
+    return read_raw(path, categories=[], chunksize=chunksize)
+
+
+def chunked_association_analysis(paths, chunksize=500_000, show_plot=True):
+    """Asociační matice přes více souborů (let) po částech, v paměti je vždy jen jedna část."""
+    accumulator = None
+    for path in paths:
+        for chunk in read_analysis_csv(path, chunksize):
+            with profiling.stage("complex_data_analysis.features", len(chunk)):
+                add_analysis_columns(chunk)
+            with profiling.stage("complex_data_analysis.association", len(chunk)):
+                if accumulator is None:
+                    accumulator = association_accumulator(chunk.columns)
+                accumulator.update(chunk)
+            print(f"{path}: {accumulator.rows} řádků")
+
+    # prázdné soubory (jen hlavička) nebo žádné soubory: matice by byla jen jednotková diagonála
+    if accumulator is None or accumulator.rows == 0:
+        raise ValueError(f"žádné řádky k analýze v {', '.join(paths) or 'prázdném seznamu souborů'}")
+    matrix = accumulator.association_matrix()
+    if show_plot:
+        with profiling.stage("complex_data_analysis.plot"):
+            plot_association_matrix(matrix)
+    return matrix
 
-    # 4. KORELAČNÍ ANALÝZA
-    # Vytvoříme kopii pro enkódování
-    df_encoded = df.copy()
 
-    print("Počítám korelační matici ze všech dostupných příznaků...")
+# --- HLAVNÍ FUNKCE ---
 
-    # Pro vizualizaci korelace sloučíme málo četné kategorie do "OTHER",
-    # aby matice nebyla rozbitá (toto se nepropíše do finálních dat)
-    cols_to_simplify = ["CAR_TYPE", "LAW_CLEAN", "COUNTRY"]
-    for col in cols_to_simplify:
-        counts = df_encoded[col].value_counts(normalize=True)
-        main_vals = counts[counts > 0.001].index
-        df_encoded[col] = df_encoded[col].where(df_encoded[col].isin(main_vals), "OTHER")
+@profiling.profiled("complex_data_analysis")
+def complex_data_analysis(df, show_plot=True):
 
-    cols_to_encode = [
-        "SEASON", "DAY_TIME", "PRAGUE", "PLACE_TYPE",
-        "CAR_TYPE", "LAW_CLEAN", "COUNTRY", "WHO_RAW"
-    ]
+    print("Zpracovávám data...")
 
-    for col in cols_to_encode:
-        if col in df_encoded.columns:
-            df_encoded[col], _ = encode_column_for_corr(df_encoded[col])
+    # 2. ZÁKLADNÍ ZPRACOVÁNÍ (IDENTICKÉ S data_process.py)
+    # Musíme dodržet přesný postup, aby seděly typy a hodnoty
 
-    # Výběr všech zajímavých sloupců pro matici
-    corr_cols = [
-        "YEAR", "MONTH_NUM", "HOUR", "WORKDAY", "SEASON", "DAY_TIME",
-        "PRAGUE", "PLACE_TYPE", "COUNTRY", "CAR_TYPE", "IS_FIRM",
-        "LAW_CLEAN", "WHO_RAW"
-    ]
-    print(df_encoded.columns)
-    corr_cols = [c for c in corr_cols if c in df_encoded.columns]
+    with profiling.stage("complex_data_analysis.features", len(df)):
+        add_analysis_columns(df)
 
-    corr_matrix = df_encoded[corr_cols].corr()
+    # 4. ASOCIAČNÍ ANALÝZA
+    # Kontingenční tabulky se počítají přímo z hodnot sloupců (bez kopie df a label encodingu),
+    # Cramérovo V s korekcí zkreslení nepotřebuje slučovat málo četné kategorie do "OTHER"
+    print("Počítám asociační matici ze všech dostupných příznaků...")
+    with profiling.stage("complex_data_analysis.association", len(df)):
+        accumulator = association_accumulator(df.columns)
+        accumulator.update(df)
+        corr_matrix = accumulator.association_matrix()
 
     if show_plot:
-        plt.figure(figsize=(14, 12))
-        sns.heatmap(
-            corr_matrix,
-            annot=True,
-            fmt=".2f",
-            cmap='coolwarm',
-            vmin=-1,
-            vmax=1,
-            annot_kws={"size": 14}  # Zvětšení písma hodnot v matici
-        )
-        plt.title("Korelační matice: Všechny extrahované příznaky", fontsize=20)  # Zvětšení nadpisu
-        plt.xticks(fontsize=14, rotation=45)  # Zvětšení a natočení popisků osy X
-        plt.yticks(fontsize=14, rotation=0)  # Zvětšení popisků osy Y
-        plt.tight_layout()
-        plt.savefig("correlation_matrix.png")
-        plt.show()
+        with profiling.stage("complex_data_analysis.plot"):
+            plot_association_matrix(corr_matrix)
 
     # 5. VÝBĚR FINÁLNÍCH SLOUPCŮ (SHODA S data_process.py)
     print("Vybírám finální sloupce pro trénink...")
@@ -250,7 +272,7 @@ if __name__ == "__main__":
     # Test shody
     try:
         print("--- SPUŠTĚNÍ COMPREHENSIVE ---")
-        raw_df = pd.read_csv("MHMP_dopravni_prestupky_2024.csv")
+        raw_df = read_analysis_csv("MHMP_dopravni_prestupky_2024.csv")
         my_df = complex_data_analysis(raw_df)
 
         print("\n--- SPUŠTĚNÍ DATA_PROCESS ---")
@@ -1,6 +1,14 @@
 import pandas as pd
-import re
+import os
+import hashlib
 import numpy as np
+from collections import OrderedDict
+
+from pattern_matcher import PatternMatcher
+from raw_loader import read_raw
+from time_parser import parse_dates, parse_hours, month_numbers
+from law_parser import parse_citation
+import profiling
 
 # --- LISTS DEFINITIONS ---
 MAIN_STREETS_LIST = [
@@ -17,6 +25,33 @@ CARS_LIST = [
     "Land Rover", "Porsche", "Mitsubishi"
 ]
 
+# square and tunnel are checked before the main streets, so they go first
+PLACE_MATCHER = PatternMatcher(
+    ["náměstí", "tunel"] + MAIN_STREETS_LIST,
+    labels=["square", "tunnel"] + ["main_street"] * len(MAIN_STREETS_LIST)
+)
+CAR_MATCHER = PatternMatcher(CARS_LIST)
+
+# column list that goes to the training
+FEATURE_COLUMNS = [
+    "SEASON", "DAY_TIME", "PRAGUE", "PLACE_TYPE",
+    "CAR_TYPE", "LAW_CLEAN", "IS_FIRM"
+]
+
+def _sources_fingerprint(names):
+    # sha1 of the source files next to this one, read one after another
+    digest = hashlib.sha1()
+    for name in names:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+# changes whenever the feature code changes, cached features are keyed by it
+FEATURES_FINGERPRINT = _sources_fingerprint(
+    ["data_process.py", "pattern_matcher.py", "law_parser.py", "time_parser.py", "raw_loader.py"]
+)
+
 
 # --- functions ---
 
@@ -47,33 +82,28 @@ def get_day_time(h):
 
 
 def get_law(text):
-    # find what law was broken
-    if not isinstance(text, str):
+    # find what law was broken: the paragraph (e.g. 125c) and the first char
+    # before ')' (125c/1k) -> 125c/k), the citation parts come from law_parser
+    parts = parse_citation(text)
+    if parts is None or not parts["paragraph"]:
         return "other"
 
-    text = text.lower().strip()
-
-    # 1. find the paragraph (e.g. 125c)
-    # look for number or char on the beginning or after §
-    paragraph_match = re.search(r'(?:§\s*|^)?(\d+[a-z]?)', text)
-    if not paragraph_match:
-        return "other"
-
-    # save the base (e.g. "125c")
-    result = paragraph_match.group(1)
-
-    # 2. look for char after the base (125c/1k) vs 125c/1f))
-    # look for char a-z before ')'
-    char_match = re.search(r'([a-z])\)', text)
-
-    if char_match:
-        result += f"/{char_match.group(1)}"
-
+    result = parts["paragraph"]
+    if parts["bracket_letter"]:
+        result += f"/{parts['bracket_letter']}"
     return result
 
-def get_country(text, limit =0.001):
-    counts = text.value_counts(normalize=True)
+def get_country(text, limit =0.001, frequencies=None):
+    # frequencies can be given from outside (e.g. counted over the whole file
+    # when the data comes in chunks), otherwise they come from text itself
+    counts = text.value_counts(normalize=True) if frequencies is None else frequencies
     valid_countries = counts[counts >= limit].index
+    if isinstance(text.dtype, pd.CategoricalDtype):
+        # decided once per category, a missing value has code -1 and gets the last label
+        categories = text.cat.categories
+        labels = np.where(categories.isin(valid_countries), categories.to_numpy(dtype=object), "other")
+        labels = np.append(labels.astype(object), "UNSPECIFIED")
+        return pd.Series(labels[text.cat.codes.to_numpy()], index=text.index, dtype=object)
     result = text.where(text.isin(valid_countries), "other")
     return result.mask(text.isna(), "UNSPECIFIED")
 
@@ -90,85 +120,220 @@ def get_prague_district(n):
 
 def get_place_type(text):
     # returns main_street, tunnel, square or other
-    if not isinstance(text, str):
-        return "other"
+    return PLACE_MATCHER.match(text, "other")
 
-    text_lower = text.lower()
 
-    # Check for square
-    if "náměstí" in text_lower:
-        return "square"
+def extract_car_brand(text):
+    # returns car brand
 
-    # Check for tunnel
-    if "tunel" in text_lower:
-        return "tunnel"
+    if not isinstance(text, str) or text == "Neuvedeno":
+        return "UNSPECIFIED"
 
-    # Check for main streets from the list
-    for street in MAIN_STREETS_LIST:
-        if street.lower() in text_lower:
-            return "main_street"
+    return CAR_MATCHER.match(text, "other")
+
+
+# --- lookup tables of get_season_vec / get_day_time_vec ---
+
+# SEASON_TABLE is indexed by month (0 = missing month),
+# DAY_TIME_TABLE by hour + 1 (so the -1 sentinel lands on index 0)
+SEASON_TABLE = np.array([get_season(m) for m in range(13)], dtype=object)
+DAY_TIME_TABLE = np.array([get_day_time(h) for h in range(-1, 24)], dtype=object)
+
+
+# --- unique values and their cache ---
+
+class FeatureCache:
+    # bounded value -> feature cache for the free text parsers, kept on disk
+    # so that the next file reuses what was already parsed.
+    # It is thrown away whenever the feature code changes (see FEATURES_FINGERPRINT).
+
+    def __init__(self, path="feature_cache.pkl", max_entries=200_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.features = {}
+        if path is not None and os.path.exists(path):
+            import joblib  # not needed by runs without a cache, and slow to import
+            stored = joblib.load(path)
+            if stored.get("fingerprint") == FEATURES_FINGERPRINT:
+                self.features = stored["features"]
+
+    def map(self, name, values, func):
+        # func(value) for every value, parsing only the ones not seen before
+        known = self.features.setdefault(name, OrderedDict())
+        results = []
+        for value in values:
+            if not isinstance(value, str):
+                results.append(func(value))
+            elif value in known:
+                known.move_to_end(value)
+                results.append(known[value])
+            else:
+                known[value] = func(value)
+                results.append(known[value])
+
+        # drop the least recently used values over the limit
+        while len(known) > self.max_entries:
+            known.popitem(last=False)
+        return results
+
+    def save(self):
+        import joblib
+        joblib.dump({"fingerprint": FEATURES_FINGERPRINT, "features": self.features}, self.path)
+
+
+def categorical_apply(series, func, cache=None):
+    # func on every distinct value only, the result is spread back by the codes
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    if cache is not None:
+        results = cache.map(func.__name__, uniques, func)
+    else:
+        results = [func(value) for value in uniques]
 
-    return "other"
+    values = np.empty(len(results), dtype=object)
+    values[:] = results
+    return pd.Series(values[codes], index=series.index, dtype=object)
 
 
-def extract_car_brand(text):
-    # returns car brand
+# --- vectorized features ---
 
-    if not isinstance(text, str) or text == "Neuvedeno":
-        return "UNSPECIFIED"
+def get_season_vec(months):
+    # months -> season through SEASON_TABLE
+    codes = months.fillna(0).to_numpy(dtype=np.int64)
+    return pd.Series(SEASON_TABLE[codes], index=months.index, dtype=object)
 
-    for car in CARS_LIST:
-        if car.lower() in text.lower():
-            return car
-    return "other"
 
+def get_day_time_vec(hours):
+    # hours (-1..23) -> day time through DAY_TIME_TABLE
+    codes = hours.to_numpy(dtype=np.int64) + 1
+    return pd.Series(DAY_TIME_TABLE[codes], index=hours.index, dtype=object)
 
-# --- main function for processing ---
-def process_data(df):
-    df = df.copy()
 
-    # converts time
-    df["DATSK"] = pd.to_datetime(df["DATSK"])
-    temp_times = pd.to_datetime(df['CASSK'], format='mixed', errors='coerce')
+def compare_with_reference(df):
+    # parity check of process_data against the frozen original feature code
+    # (reference_features.py, row by row .apply on plain strings):
+    # feature -> frame of the different rows, empty when everything is the same
+    import reference_features
+
+    current = process_data(df)
+    reference = reference_features.process_data(df)
+    mismatches = {}
+    for name in reference.columns:
+        different = current[name].astype(object) != reference[name].astype(object)
+        if different.any() or current[name].dtype != reference[name].dtype:
+            mismatches[name] = pd.DataFrame({"CURRENT": current[name], "REFERENCE": reference[name]})[different]
+    return mismatches
 
-    # basic time types
-    df["MONTH_NUM"] = df["DATSK"].dt.month
-    df["SEASON"] = df["MONTH_NUM"].apply(get_season)
-    df["HOUR"] = temp_times.dt.hour.fillna(-1).astype(int)
-    df["DAY_TIME"] = df["HOUR"].apply(get_day_time)
 
-    df["COUNTRY"] = get_country(df["MPZ"])
+# --- main function for processing ---
+@profiling.profiled("process_data")
+def process_data(df, cache=None, country_frequencies=None):
+    # the raw frame is only read, new columns go to a separate frame
+    features = pd.DataFrame(index=df.index)
+    rows = len(df)
+
+    # converts time
+    with profiling.stage("process_data.dates", rows):
+        # distinct values only, from fixed positions (see time_parser.py)
+        dates = parse_dates(df["DATSK"])
+
+        # basic time types
+        features["MONTH_NUM"] = month_numbers(dates)
+        features["SEASON"] = get_season_vec(features["MONTH_NUM"])
+        features["HOUR"] = parse_hours(df["CASSK"])
+        features["DAY_TIME"] = get_day_time_vec(features["HOUR"])
+
+    with profiling.stage("process_data.country", rows):
+        features["COUNTRY"] = get_country(df["MPZ"], frequencies=country_frequencies)
     # prague district
-    df["PRAGUE"] = df["PRAHA"].apply(get_prague_district)
+    with profiling.stage("process_data.prague", rows):
+        features["PRAGUE"] = categorical_apply(df["PRAHA"], get_prague_district, cache)
 
-    df["PLACE_TYPE"] = df["MISTOSK"].apply(get_place_type)
+    with profiling.stage("process_data.place_type", rows):
+        features["PLACE_TYPE"] = categorical_apply(df["MISTOSK"], get_place_type, cache)
 
     # car brand
-    df["CAR_TYPE"] = df["TOVZN"].apply(extract_car_brand)
+    with profiling.stage("process_data.car_type", rows):
+        features["CAR_TYPE"] = categorical_apply(df["TOVZN"], extract_car_brand, cache)
 
     # law
-    df["LAW_CLEAN"] = df["PRAVFOR"].apply(get_law)
+    with profiling.stage("process_data.law", rows):
+        features["LAW_CLEAN"] = categorical_apply(df["PRAVFOR"], get_law, cache)
 
     # car owner is person or company (true if company)
-    df["IS_FIRM"] = (df["FIRMA"] == "ANO").astype(int)
-
-    # column list that goes to the training
-
-    cols_to_keep = [
-        "SEASON", "DAY_TIME", "PRAGUE", "PLACE_TYPE",
-        "CAR_TYPE", "LAW_CLEAN", "IS_FIRM"
-    ]
+    features["IS_FIRM"] = (df["FIRMA"] == "ANO").astype(int)
 
     # we need "OZNAM" column for training
     if "OZNAM" in df.columns:
-        return df[cols_to_keep + ["OZNAM"]]
+        # plain strings whether the raw column was read as a categorical or not
+        features["OZNAM"] = df["OZNAM"].astype(object)
+        return features[FEATURE_COLUMNS + ["OZNAM"]]
     else:
-        return df[cols_to_keep]
+        return features[FEATURE_COLUMNS]
+
+
+# --- chunked processing for files that do not fit in memory ---
+
+def count_country_frequencies(path, chunksize=500_000):
+    # first pass over the file, only MPZ is read.
+    # get_country needs the frequencies of the whole file, not of one chunk
+    counts = None
+    for chunk in pd.read_csv(path, usecols=["MPZ"], chunksize=chunksize):
+        chunk_counts = chunk["MPZ"].value_counts()
+        counts = chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0)
+    if counts is None:
+        return pd.Series(dtype=float)
+    return counts / counts.sum()
+
+
+def iter_processed_chunks(path, chunksize=500_000, cache=None):
+    # process_data on the file chunk by chunk, only one raw chunk is in memory at a time
+    country_frequencies = count_country_frequencies(path, chunksize)
+    for chunk in read_raw(path, chunksize=chunksize):
+        yield process_data(chunk, cache=cache, country_frequencies=country_frequencies)
+
+
+def process_csv(path, out_path, chunksize=500_000, cache=None):
+    # streaming version of process_data(read_raw(path)).to_csv(out_path),
+    # the output file is the same as the in-memory one
+    rows = 0
+    for i, df_clean in enumerate(iter_processed_chunks(path, chunksize, cache)):
+        df_clean.to_csv(out_path, mode="w" if i == 0 else "a", header=i == 0)
+        rows += len(df_clean)
+    return rows
+
+
+def compare_chunked_with_in_memory(path, chunksize=100_000, engine=None):
+    # parity check of the chunked mode (C engine) against process_data on the whole file
+    # read with engine (read_raw's default, "auto" or "pyarrow")
+    in_memory = process_data(read_raw(path, engine=engine))
+    chunked = pd.concat(iter_processed_chunks(path, chunksize))
+    return in_memory.equals(chunked)
 
 
-'''print("loading data...")
-raw_df = pd.read_csv("MHMP_dopravni_prestupky_2024.csv")
+'''from clean_store import save_clean
 
 print("clearing data...")
-df_clean = process_data(raw_df)
-df_clean.to_csv("2024_clean.csv")'''
+df_clean = pd.concat(iter_processed_chunks("MHMP_dopravni_prestupky_2024.csv", cache=FeatureCache()))
+save_clean(df_clean, "2024_clean.npz")'''
+
+
+if __name__ == "__main__":
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "MHMP_dopravni_prestupky_2024.csv"
+    raw_df = read_raw(path)
+    mismatches = compare_with_reference(raw_df)
+    if not mismatches:
+        print("features are identical to the original row-wise ones")
+    for name, rows in mismatches.items():
+        print(f"{name}: {len(rows)} different rows (dtype {rows['CURRENT'].dtype} vs {rows['REFERENCE'].dtype})")
+        print(rows.head())
+
+    # engine="auto" of read_raw, pyarrow when it is installed
+    import importlib.util
+    engines = ["c"] + (["pyarrow"] if importlib.util.find_spec("pyarrow") else [])
+    for engine in engines:
+        if compare_chunked_with_in_memory(path, engine=engine):
+            print(f"chunked processing is identical to the in-memory one ({engine} engine)")
+        else:
+            print(f"chunked processing differs from the in-memory one ({engine} engine)")
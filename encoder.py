@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from data_process import FEATURE_COLUMNS
+
+
+class FeatureEncoder:
+    # Fitted one-hot encoding, replaces pd.get_dummies + reindex(columns=model_columns).
+    # Every category maps straight to its column index, categories without a column
+    # (the dropped first one, or values never seen in training) map to -1.
+    # transform() gives a CSR matrix, no dummy frame of all categories is built.
+
+    def __init__(self, columns, categories, numeric):
+        self.columns = list(columns)  # output columns, the same as model_columns
+        self.categories = categories  # feature -> {value: column index}
+        self.numeric = numeric  # feature -> column index
+
+        # value lists and their column indices, for pd.Categorical recoding.
+        # The extra -1 at the end is where code -1 (value not in the list) lands
+        self._values = {}
+        self._positions = {}
+        for feature, mapping in categories.items():
+            self._values[feature] = list(mapping)
+            self._positions[feature] = np.array(list(mapping.values()) + [-1], dtype=np.int64)
+
+    @classmethod
+    def fit(cls, df, drop_first=True):
+        # the same columns in the same order as pd.get_dummies(df, drop_first=drop_first):
+        # numeric columns first, then the sorted categories of every text column
+        text_features = [
+            feature for feature in df.columns
+            if not (pd.api.types.is_numeric_dtype(df[feature]) or pd.api.types.is_bool_dtype(df[feature]))
+        ]
+        numeric_features = [feature for feature in df.columns if feature not in text_features]
+
+        columns = list(numeric_features)
+        numeric = {feature: i for i, feature in enumerate(numeric_features)}
+        categories = {}
+        for feature in text_features:
+            if isinstance(df[feature].dtype, pd.CategoricalDtype):
+                values = list(df[feature].cat.categories)
+            else:
+                values = sorted(df[feature].dropna().unique())
+            mapping = {}
+            for i, value in enumerate(values):
+                if drop_first and i == 0:
+                    mapping[value] = -1
+                else:
+                    mapping[value] = len(columns)
+                    columns.append(f"{feature}_{value}")
+            categories[feature] = mapping
+        return cls(columns, categories, numeric)
+
+    @classmethod
+    def from_columns(cls, model_columns, features=FEATURE_COLUMNS):
+        # rebuilt from a saved model_columns list (models trained before the encoder existed)
+        numeric = {}
+        categories = {feature: {} for feature in features if feature not in model_columns}
+        for position, column in enumerate(model_columns):
+            if column in features:
+                numeric[column] = position
+                continue
+            for feature in categories:
+                if column.startswith(feature + "_"):
+                    categories[feature][column[len(feature) + 1:]] = position
+                    break
+        return cls(model_columns, categories, numeric)
+
+    def column_indices(self, df):
+        # feature -> column index of every row (-1 = no column)
+        indices = {}
+        for feature, values in self._values.items():
+            codes = pd.Categorical(df[feature], categories=values).codes
+            indices[feature] = self._positions[feature][codes]
+        return indices
+
+    def transform(self, df, dtype=np.float64):
+        # CSR matrix with the model columns.
+        # Every row has at most one entry per feature, so the (rows x features) table
+        # of column indices read row by row is already the CSR layout
+        positions = list(self.column_indices(df).values())
+        data = [np.ones(len(df), dtype=dtype)] * len(positions)
+        for feature, position in self.numeric.items():
+            values = df[feature].to_numpy(dtype=dtype)
+            positions.append(np.where(values != 0, position, -1))
+            data.append(values)
+
+        positions = np.column_stack(positions) if positions else np.empty((len(df), 0), dtype=np.int64)
+        data = np.column_stack(data) if data else np.empty((len(df), 0), dtype=dtype)
+        has_column = positions >= 0
+        indptr = np.concatenate([[0], np.cumsum(has_column.sum(axis=1))])
+        return sparse.csr_matrix(
+            (data[has_column], positions[has_column], indptr), shape=(len(df), len(self.columns))
+        )
+
+    def transform_records(self, records, dtype=np.float64):
+        # dense matrix from a list of dicts, cheaper than pandas for a handful of rows
+        X = np.zeros((len(records), len(self.columns)), dtype=dtype)
+        for row, record in enumerate(records):
+            for feature, value in record.items():
+                if feature in self.numeric:
+                    X[row, self.numeric[feature]] = value
+                elif feature in self.categories:
+                    position = self.categories[feature].get(value, -1)
+                    if position >= 0:
+                        X[row, position] = 1
+        return X
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+
+# Chunk by chunk version of the predict.py evaluation.
+# Only counts of (actual, predicted) pairs and the first few misclassified rows are kept,
+# misclassified rows are appended to the errors CSV as they come,
+# so memory depends on the chunk size and not on the whole dataset.
+
+# context columns of the results / errors table (results column -> df_clean column)
+CONTEXT_COLUMNS = {
+    "SEASON": "SEASON",
+    "DAY_TIME": "DAY_TIME",
+    "PRAGUE": "PRAGUE",
+    "PLACE_TYPE": "PLACE_TYPE",
+    "CAR_TYPE": "CAR_TYPE",
+    "LAW": "LAW_CLEAN",
+    "IS_FIRM": "IS_FIRM",
+}
+
+
+class StreamingEvaluation:
+
+    def __init__(self, errors_path="model_errors.csv", sample_size=5):
+        self.errors_path = errors_path
+        self.sample_size = sample_size
+        self.pair_counts = {}  # (actual, predicted) -> rows
+        self.total_count = 0
+        self.correct_count = 0
+        self.error_count = 0
+        self.error_sample = None  # the first misclassified rows
+        self.unlabeled_count = 0  # rows without OZNAM, they have nothing to be compared with
+
+    def update(self, df_chunk, prediction_text, probability):
+        labeled = df_chunk["OZNAM"].notna().to_numpy()
+        if not labeled.all():
+            self.unlabeled_count += int((~labeled).sum())
+            df_chunk = df_chunk[labeled]
+            prediction_text = np.asarray(prediction_text, dtype=object)[labeled]
+            probability = np.asarray(probability)[labeled]
+        actual = np.asarray(df_chunk["OZNAM"], dtype=object)
+        predicted = np.asarray(prediction_text, dtype=object)
+        match = actual == predicted
+
+        pairs = pd.DataFrame({"ACTUAL": actual, "PREDICTED": predicted}).value_counts(dropna=False)
+        for pair, count in pairs.items():
+            self.pair_counts[pair] = self.pair_counts.get(pair, 0) + int(count)
+        self.total_count += len(actual)
+        self.correct_count += int(match.sum())
+
+        if match.all():
+            return
+        # the results table is built for the misclassified rows only
+        wrong = ~match
+        errors = pd.DataFrame({
+            "ACTUAL": df_chunk["OZNAM"][wrong],
+            "PREDICTED": predicted[wrong],
+            "CONFIDENCE": np.asarray(probability)[wrong],
+            **{name: df_chunk[column][wrong] for name, column in CONTEXT_COLUMNS.items()},
+        })
+        errors["MATCH"] = False
+
+        errors.to_csv(self.errors_path, index=False, mode="w" if self.error_count == 0 else "a",
+                      header=self.error_count == 0)
+        self.error_count += len(errors)
+        if self.error_sample is None:
+            self.error_sample = errors.head(self.sample_size)
+        elif len(self.error_sample) < self.sample_size:
+            missing = self.sample_size - len(self.error_sample)
+            self.error_sample = pd.concat([self.error_sample, errors.head(missing)])
+
+    def confusion_matrix(self):
+        # (labels, matrix) with actual classes in rows, predicted in columns
+        labels = sorted({label for pair in self.pair_counts for label in pair})
+        position = {label: i for i, label in enumerate(labels)}
+        matrix = np.zeros((len(labels), len(labels)), dtype=np.int64)
+        for (actual, predicted), count in self.pair_counts.items():
+            matrix[position[actual], position[predicted]] = count
+        return labels, matrix
+
+    def precision_recall(self):
+        # class -> (precision, recall) so far
+        labels, matrix = self.confusion_matrix()
+        correct = np.diag(matrix)
+        predicted = matrix.sum(axis=0)
+        actual = matrix.sum(axis=1)
+        return {
+            label: (correct[i] / predicted[i] if predicted[i] else 0.0,
+                    correct[i] / actual[i] if actual[i] else 0.0)
+            for i, label in enumerate(labels)
+        }
+
+    def report_scores(self):
+        # per class precision / recall / f1 / support like sklearn computes them
+        # (0 where a class has no predicted or no true rows)
+        labels, matrix = self.confusion_matrix()
+        correct = np.diag(matrix).astype(float)
+        predicted = matrix.sum(axis=0)
+        actual = matrix.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = np.where(predicted > 0, correct / predicted, 0.0)
+            recall = np.where(actual > 0, correct / actual, 0.0)
+            f1_denominator = 2 * correct + (predicted - correct) + (actual - correct)
+            f1 = np.where(f1_denominator > 0, 2 * correct / f1_denominator, 0.0)
+        return labels, precision, recall, f1, actual
+
+    def classification_report(self, digits=4):
+        # the text of sklearn's classification_report computed from the pair counts,
+        # without importing sklearn.metrics (about a second of every scoring run)
+        labels, precision, recall, f1, support = self.report_scores()
+        total = int(support.sum())
+        if not labels:
+            return "no labelled rows to report\n"
+
+        headers = ["precision", "recall", "f1-score", "support"]
+        width = max(max(len(str(name)) for name in labels), len("weighted avg"), digits)
+        row_fmt = "{:>{width}s} " + " {:>9.{digits}f}" * 3 + " {:>9}\n"
+
+        text = ("{:>{width}s} " + " {:>9}" * len(headers)).format("", *headers, width=width)
+        text += "\n\n"
+        for i, name in enumerate(labels):
+            text += row_fmt.format(str(name), precision[i], recall[i], f1[i], int(support[i]),
+                                   width=width, digits=digits)
+        text += "\n"
+        accuracy = np.diag(self.confusion_matrix()[1]).sum() / total if total else 0.0
+        row_fmt_accuracy = "{:>{width}s} " + " {:>9.{digits}}" * 2 + " {:>9.{digits}f}" + " {:>9}\n"
+        text += row_fmt_accuracy.format("accuracy", "", "", accuracy, total, width=width, digits=digits)
+        text += row_fmt.format("macro avg", precision.mean(), recall.mean(), f1.mean(), total,
+                               width=width, digits=digits)
+        weights = support / total if total else np.zeros(len(labels))
+        text += row_fmt.format("weighted avg", weights @ precision, weights @ recall, weights @ f1, total,
+                               width=width, digits=digits)
+        return text
+
+    def print_report(self):
+        # the same printout as the in-memory evaluation of predict.py
+        accuracy = (self.correct_count / self.total_count) * 100 if self.total_count else 0.0
+
+        print(f"\n==========================================")
+        print(f"FULL DATASET EVALUATION RESULTS")
+        print(f"==========================================")
+        print(f"Total rows:      {self.total_count}")
+        print(f"Correctly pred.: {self.correct_count}")
+        print(f"Errors:          {self.total_count - self.correct_count}")
+        print(f"Accuracy:        {accuracy:.2f} %")
+        if self.unlabeled_count:
+            print(f"Without OZNAM:   {self.unlabeled_count} (not evaluated)")
+        print(f"==========================================\n")
+
+        if not self.total_count:
+            print("No labelled rows to evaluate.")
+        elif self.error_count:
+            print("Sample of 5 misclassified instances:")
+            print(self.error_sample[["ACTUAL", "PREDICTED", "CONFIDENCE", "LAW", "CAR_TYPE"]])
+            print(f"\nList of all errors saved to '{self.errors_path}'.")
+        else:
+            print("Congratulations! The model made zero errors.")
+
+        print("\n--- DETAIL CLASSIFICATION REPORT ---")
+        print(self.classification_report(digits=4))
+        print("==========================================\n")
@@ -0,0 +1,169 @@
+import io
+import os
+import sys
+import json
+import hashlib
+import itertools
+
+import pandas as pd
+
+from data_process import process_data, FEATURES_FINGERPRINT
+from clean_store import save_clean, load_clean
+from raw_loader import check_raw_columns, raw_dtypes
+import profiling
+
+# Cleaned features of raw MHMP files kept between runs and refreshed incrementally.
+# Every source file is split into blocks of block_rows lines; the store keeps the
+# features of every block (clean_store .npz) and a manifest with the sha1 of the
+# block's raw bytes, the row count (watermark), the file size / mtime and the pipeline
+# version (FEATURES_FINGERPRINT). A refresh re-reads the file, hashes the blocks and
+# runs process_data only on blocks that are new or whose bytes changed, so a file
+# re-published with a new month appended costs the new rows plus the last old block.
+# A different pipeline version (the feature code changed) rebuilds everything,
+# an unchanged file (same size and mtime) is not even read.
+# Like parallel_process, blocks are counted in lines: no line breaks inside quotes.
+#
+#   store = FeatureStore("feature_store")
+#   store.refresh("MHMP_dopravni_prestupky_2024.csv")
+#   for df_clean in store.iter_chunks("MHMP_dopravni_prestupky_2024.csv"): ...
+#
+#   python feature_store.py MHMP_dopravni_prestupky_2024.csv [...]
+
+STORE_FORMAT = 1
+BLOCK_ROWS = 100_000
+
+
+def _iter_raw_blocks(path, block_rows):
+    # (header line, bytes of block_rows lines) for every block of the file
+    with open(path, "rb") as file:
+        header = file.readline()
+        while True:
+            lines = list(itertools.islice(file, block_rows))
+            if not lines:
+                return
+            yield header, b"".join(lines)
+
+
+class FeatureStore:
+
+    def __init__(self, directory="feature_store", block_rows=BLOCK_ROWS, cache=None):
+        self.directory = directory
+        self.block_rows = block_rows
+        self.cache = cache  # data_process.FeatureCache for the free text features
+
+    def source_directory(self, path):
+        # one directory per source file, the file name plus a hash of its full path
+        name = os.path.splitext(os.path.basename(path))[0]
+        key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:10]
+        return os.path.join(self.directory, f"{name}-{key}")
+
+    def _block_path(self, path, number):
+        return os.path.join(self.source_directory(path), f"block_{number:05d}.npz")
+
+    def manifest(self, path):
+        manifest_path = os.path.join(self.source_directory(path), "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        return manifest if manifest.get("format") == STORE_FORMAT else None
+
+    def is_current(self, path, manifest=None):
+        # the stored features belong to this exact file and feature code
+        manifest = self.manifest(path) if manifest is None else manifest
+        if manifest is None:
+            return False
+        stat = os.stat(path)
+        return (manifest["pipeline_version"] == FEATURES_FINGERPRINT
+                and manifest["block_rows"] == self.block_rows
+                and manifest["size"] == stat.st_size
+                and manifest["mtime_ns"] == stat.st_mtime_ns)
+
+    @profiling.profiled("feature_store.refresh")
+    def refresh(self, path):
+        # brings the features of path up to date, returns how much work that was
+        manifest = self.manifest(path)
+        stats = {"rows": 0, "blocks": 0, "processed_rows": 0, "processed_blocks": 0}
+        if self.is_current(path, manifest):
+            stats["rows"] = manifest["rows"]
+            stats["blocks"] = len(manifest["blocks"])
+            return stats
+
+        usecols = check_raw_columns(path)
+        dtypes = raw_dtypes(usecols)
+        stat = os.stat(path)
+        reusable = (manifest is not None
+                    and manifest["pipeline_version"] == FEATURES_FINGERPRINT
+                    and manifest["block_rows"] == self.block_rows)
+        old_blocks = manifest["blocks"] if reusable else []
+        os.makedirs(self.source_directory(path), exist_ok=True)
+
+        blocks = []
+        for number, (header, raw_bytes) in enumerate(_iter_raw_blocks(path, self.block_rows)):
+            digest = hashlib.sha1(header + raw_bytes).hexdigest()
+            if (number < len(old_blocks) and old_blocks[number]["sha1"] == digest
+                    and os.path.exists(self._block_path(path, number))):
+                blocks.append(old_blocks[number])
+                continue
+
+            with profiling.stage("feature_store.block") as current:
+                raw = pd.read_csv(io.BytesIO(header + raw_bytes), usecols=usecols, dtype=dtypes)
+                current.rows = len(raw)
+                df_clean = process_data(raw, cache=self.cache).reset_index(drop=True)
+                save_clean(df_clean, self._block_path(path, number))
+            blocks.append({"sha1": digest, "rows": len(df_clean)})
+            stats["processed_blocks"] += 1
+            stats["processed_rows"] += len(df_clean)
+
+        # blocks of a file that got shorter
+        for number in range(len(blocks), len(old_blocks)):
+            if os.path.exists(self._block_path(path, number)):
+                os.remove(self._block_path(path, number))
+
+        rows = sum(block["rows"] for block in blocks)
+        manifest = {
+            "format": STORE_FORMAT,
+            "source": os.path.abspath(path),
+            "pipeline_version": FEATURES_FINGERPRINT,
+            "block_rows": self.block_rows,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "rows": rows,
+            # content fingerprint of the whole file
+            "sha1": hashlib.sha1("".join(block["sha1"] for block in blocks).encode()).hexdigest(),
+            "blocks": blocks,
+        }
+        # the manifest goes last, an interrupted refresh just redoes the blocks next time
+        manifest_path = os.path.join(self.source_directory(path), "manifest.json")
+        with open(manifest_path + ".tmp", "w") as file:
+            json.dump(manifest, file, indent=1)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+        stats["rows"] = rows
+        stats["blocks"] = len(blocks)
+        return stats
+
+    def iter_chunks(self, path, columns=None):
+        # the stored features block by block, indexed by the row position in the file
+        # like iter_processed_chunks (refresh() first)
+        manifest = self.manifest(path)
+        if not self.is_current(path, manifest):
+            raise ValueError(f"the features of {path} in {self.directory} are not current, refresh first")
+        start = 0
+        for number, block in enumerate(manifest["blocks"]):
+            df_clean = load_clean(self._block_path(path, number), columns, FEATURES_FINGERPRINT)
+            df_clean.index = pd.RangeIndex(start, start + block["rows"])
+            start += block["rows"]
+            yield df_clean
+
+    def load(self, path, columns=None):
+        self.refresh(path)
+        return pd.concat(self.iter_chunks(path, columns))
+
+
+if __name__ == "__main__":
+    store = FeatureStore()
+    for source in sys.argv[1:]:
+        result = store.refresh(source)
+        print(f"{source}: {result['rows']} rows in {result['blocks']} blocks, "
+              f"processed {result['processed_rows']} rows in {result['processed_blocks']} blocks")
@@ -0,0 +1,214 @@
+import sys
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from data_process import MAIN_STREETS_LIST, CARS_LIST
+
+# Synthetic MHMP_dopravni_prestupky_*.csv files of any size for load testing.
+#
+#   python generate_mhmp.py fit MHMP_dopravni_prestupky_2023.csv -o mhmp_profile.json
+#   python generate_mhmp.py generate 100000000 MHMP_synthetic.csv --profile mhmp_profile.json
+#
+# A profile holds the class frequencies of OZNAM and, per class, the most frequent
+# values of every other column with their probabilities. Rows are generated class first,
+# then every column from its distribution within the class, so the columns keep
+# their relation to OZNAM (but not to each other). Without a profile a built-in one is used.
+# On top of the profile the dirty formats the cleaning code deals with are added on purpose:
+# HH:MM times, missing times, "směr" suffixes and odd law citations.
+# The file is written chunk by chunk, memory does not depend on the number of rows.
+
+MHMP_COLUMNS = ["DATSK", "CASSK", "PRAHA", "MISTOSK", "TOVZN", "PRAVFOR", "MPZ", "FIRMA", "OSOBA", "OZNAM"]
+PROFILE_VERSION = 1
+
+# share of rows that get each dirty format
+DEFAULT_DIRTY = {
+    "short_time": 0.05,  # 14:30 instead of 14:30:00
+    "missing_time": 0.03,
+    "smer": 0.05,  # "Evropská směr Letiště"
+    "odd_law": 0.05,  # "§ 125C odst. 1 písm. k) bod 2" and similar spellings
+}
+
+
+def _distribution(counts, top_values):
+    # the most frequent values and their probabilities (NaN as None)
+    counts = counts.sort_values(ascending=False).head(top_values)
+    values = [None if pd.isna(value) else value for value in counts.index]
+    return {"values": values, "p": (counts / counts.sum()).round(8).tolist()}
+
+
+def fit_profile(path, top_values=5000, chunksize=500_000):
+    # value counts of every column per OZNAM class, read in chunks
+    class_counts = None
+    counts = {column: {} for column in MHMP_COLUMNS if column != "OZNAM"}
+    rows = 0
+    for chunk in pd.read_csv(path, usecols=MHMP_COLUMNS, dtype=str, keep_default_na=False,
+                             na_values=[""], chunksize=chunksize):
+        rows += len(chunk)
+        chunk_classes = chunk["OZNAM"].value_counts()
+        class_counts = chunk_classes if class_counts is None else class_counts.add(chunk_classes, fill_value=0)
+        for label, group in chunk.groupby("OZNAM"):
+            for column in counts:
+                value_counts = group[column].value_counts(dropna=False)
+                previous = counts[column].get(label)
+                counts[column][label] = value_counts if previous is None else previous.add(value_counts, fill_value=0)
+
+    return {
+        "version": PROFILE_VERSION,
+        "source": path,
+        "rows": rows,
+        "classes": _distribution(class_counts, top_values),
+        "columns": {
+            column: {label: _distribution(value_counts, top_values) for label, value_counts in per_class.items()}
+            for column, per_class in counts.items()
+        },
+    }
+
+
+def _weights(values, weight):
+    p = np.array([weight(value) for value in values], dtype=float)
+    return {"values": list(values), "p": (p / p.sum()).tolist()}
+
+
+def default_profile():
+    # a hand-made profile for when no real file is at hand: MPP (městská policie) mostly
+    # parking and city streets, PČR more main roads, speeding and foreign cars
+    dates = pd.date_range("2023-01-01", "2023-12-31").strftime("%Y-%m-%d").tolist()
+    hour_weight = [1, 1, 1, 1, 1, 2, 4, 6, 8, 8, 8, 8, 8, 8, 8, 8, 7, 6, 5, 4, 3, 2, 2, 1]
+    times = [f"{hour:02d}:{minute:02d}:{second:02d}" for hour in range(24)
+             for minute in range(0, 60, 5) for second in (0, 30)]
+    districts = [f"Praha {number}" for number in range(1, 23)] + ["Praha-Zbraslav", "Praha - Ostatní", None]
+    city_streets = ["Vinohradská", "Národní", "Václavské náměstí", "náměstí Míru", "Karlovo náměstí",
+                    "Žitná", "Myslíkova", "Italská", "Korunní", "Tunel Blanka", "Strahovský tunel", None]
+    brands = [f"{brand} {model}".strip() for brand in CARS_LIST for model in ("", "combi")] + ["Neuvedeno", "Tatra", None]
+    parking_laws = ["§ 125c/1k)", "125c odst. 1 písm. k)", "§ 4 písm. b) zák. 361/2000", "125f", "16/2b)"]
+    driving_laws = ["§ 125c/1f) 2", "125c odst. 1 písm. f) bod 3", "§ 125c/1f) 3", "137", "125d/1a)"]
+    countries = ["CZ", "SK", "D", "PL", "UA", "A", "H", None]
+
+    def column(mpp, pcr):
+        return {"MPP": mpp, "PČR": pcr}
+
+    return {
+        "version": PROFILE_VERSION,
+        "source": "built-in",
+        "classes": {"values": ["MPP", "PČR"], "p": [0.8, 0.2]},
+        "columns": {
+            "DATSK": column(_weights(dates, lambda d: 1), _weights(dates, lambda d: 1)),
+            "CASSK": column(_weights(times, lambda t: hour_weight[int(t[:2])]),
+                            _weights(times, lambda t: hour_weight[(int(t[:2]) + 3) % 24])),
+            "PRAHA": column(_weights(districts, lambda d: 5 if d in ("Praha 1", "Praha 2") else 1),
+                            _weights(districts, lambda d: 1)),
+            "MISTOSK": column(
+                _weights(city_streets + MAIN_STREETS_LIST, lambda s: 6 if s in city_streets else 1),
+                _weights(city_streets + MAIN_STREETS_LIST, lambda s: 1 if s in city_streets else 3)),
+            "TOVZN": column(_weights(brands, lambda b: 1), _weights(brands, lambda b: 2 if b == "Neuvedeno" else 1)),
+            "PRAVFOR": column(
+                _weights(parking_laws + driving_laws, lambda law: 8 if law in parking_laws else 1),
+                _weights(parking_laws + driving_laws, lambda law: 1 if law in parking_laws else 4)),
+            "MPZ": column(_weights(countries, lambda c: 60 if c == "CZ" else 1),
+                          _weights(countries, lambda c: 30 if c == "CZ" else 2)),
+            "FIRMA": column({"values": ["ANO", "NE"], "p": [0.3, 0.7]}, {"values": ["ANO", "NE"], "p": [0.2, 0.8]}),
+            "OSOBA": column({"values": ["ANO", "NE"], "p": [0.7, 0.3]}, {"values": ["ANO", "NE"], "p": [0.8, 0.2]}),
+        },
+    }
+
+
+def _sample(distribution, n, rng):
+    values = np.array(distribution["values"], dtype=object)
+    values[pd.isna(values)] = np.nan
+    p = np.asarray(distribution["p"], dtype=float)
+    return values[rng.choice(len(values), size=n, p=p / p.sum())]
+
+
+def _odd_law(citations, rng):
+    # other spellings of the same citation
+    variant = rng.integers(0, 5, size=len(citations))
+    citations = citations.copy()
+    citations[variant == 0] = "§ " + citations[variant == 0]
+    citations[variant == 1] = citations[variant == 1].str.upper()
+    citations[variant == 2] = (citations[variant == 2]
+                               .str.replace("/", " odst. ", n=1, regex=False)
+                               .str.replace(r"(\d)([a-z]\))", r"\1 písm. \2", regex=True))
+    citations[variant == 3] = citations[variant == 3] + " bod " + pd.Series(
+        rng.integers(1, 10, size=int((variant == 3).sum())), index=citations.index[variant == 3]).astype(str)
+    citations[variant == 4] = citations[variant == 4].str.replace(" ", "  ", regex=False)
+    return citations
+
+
+def add_dirty_formats(df, rng, dirty=DEFAULT_DIRTY):
+    n = len(df)
+    times = df["CASSK"]
+    short = (rng.random(n) < dirty.get("short_time", 0)) & (times.str.len() == 8)
+    df.loc[short, "CASSK"] = times[short].str[:5]
+    df.loc[rng.random(n) < dirty.get("missing_time", 0), "CASSK"] = np.nan
+
+    places = df["MISTOSK"]
+    smer = (rng.random(n) < dirty.get("smer", 0)) & places.notna()
+    directions = places.sample(frac=1, random_state=int(rng.integers(2**31))).to_numpy()
+    df.loc[smer, "MISTOSK"] = places[smer] + " směr " + pd.Series(directions, index=df.index)[smer].fillna("centrum")
+
+    odd = (rng.random(n) < dirty.get("odd_law", 0)) & df["PRAVFOR"].notna()
+    df.loc[odd, "PRAVFOR"] = _odd_law(df.loc[odd, "PRAVFOR"], rng)
+    return df
+
+
+def generate_frame(profile, rows, rng, dirty=DEFAULT_DIRTY):
+    labels = _sample(profile["classes"], rows, rng)
+    df = pd.DataFrame(index=pd.RangeIndex(rows), columns=MHMP_COLUMNS, dtype=object)
+    for column, per_class in profile["columns"].items():
+        values = np.empty(rows, dtype=object)
+        for label, distribution in per_class.items():
+            in_class = labels == label
+            values[in_class] = _sample(distribution, int(in_class.sum()), rng)
+        df[column] = values
+    df["OZNAM"] = labels
+    return add_dirty_formats(df, rng, dirty) if dirty else df
+
+
+def generate_csv(profile, rows, out_path, chunk_rows=1_000_000, seed=0, dirty=DEFAULT_DIRTY):
+    rng = np.random.default_rng(seed)
+    if rows == 0:
+        pd.DataFrame(columns=MHMP_COLUMNS).to_csv(out_path, index=False)
+    for start in range(0, rows, chunk_rows):
+        generate_frame(profile, min(chunk_rows, rows - start), rng, dirty).to_csv(
+            out_path, index=False, mode="w" if start == 0 else "a", header=start == 0
+        )
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="synthetic MHMP traffic offence files")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fit = commands.add_parser("fit", help="fit a profile to a real MHMP file")
+    fit.add_argument("source")
+    fit.add_argument("-o", "--output", default="mhmp_profile.json")
+    fit.add_argument("--top-values", type=int, default=5000, help="values kept per column and class")
+
+    generate = commands.add_parser("generate", help="write a synthetic file")
+    generate.add_argument("rows", type=int)
+    generate.add_argument("output")
+    generate.add_argument("--profile", default=None, help="profile JSON (built-in profile if not given)")
+    generate.add_argument("--seed", type=int, default=0)
+    generate.add_argument("--chunk-rows", type=int, default=1_000_000)
+    generate.add_argument("--no-dirty", action="store_true", help="only the profile values, no dirty formats")
+    args = parser.parse_args()
+
+    if args.command == "fit":
+        profile = fit_profile(args.source, args.top_values)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(profile, file, ensure_ascii=False)
+        print(f"profile of {profile['rows']} rows -> {args.output}")
+    else:
+        if args.profile:
+            with open(args.profile, encoding="utf-8") as file:
+                profile = json.load(file)
+            if profile.get("version") != PROFILE_VERSION:
+                sys.exit(f"{args.profile} has profile version {profile.get('version')}, expected {PROFILE_VERSION}")
+        else:
+            profile = default_profile()
+        rows = generate_csv(profile, args.rows, args.output, args.chunk_rows, args.seed,
+                            None if args.no_dirty else DEFAULT_DIRTY)
+        print(f"{rows} rows -> {args.output}")
@@ -0,0 +1,481 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.special import expit
+
+from data_process import FEATURE_COLUMNS, FEATURES_FINGERPRINT
+from encoder import FeatureEncoder
+import profiling
+
+# Model artifacts written by train.py and the scoring path shared by
+# predict.py and predict_server.py.
+
+MODEL_FILES = {
+    "mlp": "model_mlp.pkl",
+    "scaler": "model_scaler.pkl",
+    "model_columns": "model_columns.pkl",
+    "le": "model_le.pkl",
+}
+# written by train.py next to model_columns.pkl, older models rebuild it from the column list
+ENCODER_FILE = "model_encoder.pkl"
+
+# The same model as one directory: plain .npy arrays (weights with the scaler folded in,
+# scaler statistics, optionally the PredictionTable of the training data's feature combinations)
+# and manifest.json (column vocabulary, label classes, feature schema).
+# The arrays are opened with mmap_mode="r", so scorer processes on one host share
+# the pages of the files instead of each unpickling its own copy, and loading
+# does not need sklearn at all.
+BUNDLE_DIR = "model_bundle"
+BUNDLE_FORMAT = 1
+
+
+ACTIVATIONS = {
+    "identity": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0, out=x),
+    "tanh": lambda x: np.tanh(x, out=x),
+    "logistic": lambda x: expit(x, out=x),
+}
+
+
+def flush_subnormals(arrays, dtype):
+    # dead units end up with subnormal weights (~1e-316), they change nothing
+    # but make every matrix product several times slower
+    for array in arrays:
+        array[np.abs(array) < np.finfo(dtype).tiny] = 0
+
+
+class FusedMLP:
+    # forward pass of a fitted MLPClassifier in plain NumPy.
+    # StandardScaler is folded into the first layer:
+    #   ((x - mean) / scale) @ W + b  ==  x @ (W / scale) + (b - (mean / scale) @ W)
+    # so the input goes in unscaled and no scaled copy is made.
+    # Labels and confidences come from one pass (sklearn runs it twice for predict + predict_proba).
+
+    def __init__(self, coefs, intercepts, activation, out_activation, dtype=np.float64, block_rows=None):
+        # arrays of the right dtype are used as they are (no copy), so memory mapped
+        # weights of a bundle stay shared
+        self.coefs = [np.ascontiguousarray(w, dtype=dtype) for w in coefs]
+        self.intercepts = [np.ascontiguousarray(b, dtype=dtype) for b in intercepts]
+        self.activation = activation
+        self.out_activation = out_activation
+        self.dtype = dtype
+        self.block_rows = block_rows  # rows per block, None = all at once
+
+    @classmethod
+    def from_sklearn(cls, mlp, scaler=None, dtype=np.float64, block_rows=None):
+        coefs = [w.astype(np.float64) for w in mlp.coefs_]
+        intercepts = [b.astype(np.float64) for b in mlp.intercepts_]
+        if scaler is not None:
+            mean = scaler.mean_ if scaler.with_mean else np.zeros(coefs[0].shape[0])
+            scale = scaler.scale_ if scaler.with_std else np.ones(coefs[0].shape[0])
+            intercepts[0] = intercepts[0] - (mean / scale) @ coefs[0]
+            coefs[0] = coefs[0] / scale[:, None]
+        flush_subnormals(coefs + intercepts, dtype)
+        return cls(coefs, intercepts, mlp.activation, mlp.out_activation_, dtype, block_rows)
+
+    def _forward(self, X):
+        activation = ACTIVATIONS[self.activation]
+        for i, (w, b) in enumerate(zip(self.coefs, self.intercepts)):
+            X = X @ w
+            X += b
+            if i < len(self.coefs) - 1:
+                activation(X)
+        return X
+
+    def _predict_block(self, X):
+        output = self._forward(X)
+        if self.out_activation == "logistic" and output.shape[1] == 1:
+            # binary case, p is the probability of class 1
+            p = expit(output[:, 0])
+            return (p > 0.5).astype(np.intp), np.maximum(p, 1 - p)
+        if self.out_activation == "logistic":
+            probability = expit(output)
+        else:
+            # softmax
+            probability = np.exp(output - output.max(axis=1, keepdims=True))
+            probability /= probability.sum(axis=1, keepdims=True)
+        return probability.argmax(axis=1), probability.max(axis=1)
+
+    def predict(self, X):
+        # X is the unscaled one-hot matrix (dense or CSR), returns (class index, confidence)
+        X = X.astype(self.dtype).tocsr() if sparse.issparse(X) else np.asarray(X, dtype=self.dtype)
+        n = X.shape[0]
+        if not self.block_rows or n <= self.block_rows:
+            return self._predict_block(X)
+        index = np.empty(n, dtype=np.intp)
+        confidence = np.empty(n, dtype=self.dtype)
+        for start in range(0, n, self.block_rows):
+            block = slice(start, start + self.block_rows)
+            index[block], confidence[block] = self._predict_block(X[block])
+        return index, confidence
+
+
+class PredictionTable:
+    # (class index, confidence) of every combination of encoded feature values scored so far.
+    # The key of a row is one int64 packing the column index of every categorical feature
+    # (all values without a column, the dropped first one and unseen ones, are one code)
+    # and the value of every numeric one, so two rows with the same key have the same
+    # one-hot row and the same model output. The features have few values, the combinations
+    # that occur are a small fraction of the rows: scoring a chunk is a searchsorted in the
+    # sorted keys, only the combinations not in the table go through the MLP.
+    # Numeric values outside 0..NUMERIC_RADIX-1 have no key (-1), those rows are always scored.
+
+    NUMERIC_RADIX = 1 << 16
+
+    def __init__(self, encoder, keys=(), index=(), confidence=(), dtype=np.float64):
+        self.encoder = encoder
+        # categorical feature -> value -> code 1..k of its column (0 = no column)
+        self._value_codes = {}
+        self.radices = []
+        for feature, mapping in encoder.categories.items():
+            positions = sorted({position for position in mapping.values() if position >= 0})
+            codes = {position: code for code, position in enumerate(positions, 1)}
+            self._value_codes[feature] = {value: codes.get(position, 0) for value, position in mapping.items()}
+            self.radices.append(len(positions) + 1)
+        self.radices += [self.NUMERIC_RADIX] * len(encoder.numeric)
+        if np.prod(np.asarray(self.radices, dtype=float)) >= 2.0**62:
+            raise ValueError("the feature combinations of the model do not fit one int64 key")
+
+        keys = np.asarray(keys, dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.index = np.asarray(index, dtype=np.intp)[order]
+        self.confidence = np.asarray(confidence, dtype=dtype)[order]
+        self._entries = None  # key -> (class index, confidence) for predict_records, built on first use
+
+    def __len__(self):
+        return len(self.keys)
+
+    def frame_keys(self, df):
+        # int64 key of every row, -1 where a numeric value has no code.
+        # Every column is factorized once (a categorical column already has its codes) and
+        # only its distinct values are mapped to table codes, no recoding of the rows
+        columns = []
+        for feature, value_codes in self._value_codes.items():
+            column = df[feature]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                codes, values = column.cat.codes.to_numpy(), column.cat.categories
+            else:
+                codes, values = pd.factorize(column)
+            # code -1 (missing value) lands on the extra 0 at the end: no column
+            table_codes = np.array([value_codes.get(value, 0) for value in values] + [0], dtype=np.int64)
+            columns.append(table_codes[codes])
+        for feature in self.encoder.numeric:
+            values = df[feature].to_numpy()
+            if values.dtype.kind == "f":
+                whole = np.isfinite(values) & (values == np.round(values))
+                codes = np.where(whole, values, -1).astype(np.int64)
+            else:
+                codes = values.astype(np.int64)
+            columns.append(codes)
+        key = np.zeros(len(df), dtype=np.int64)
+        valid = np.ones(len(df), dtype=bool)
+        for codes, radix in zip(columns, self.radices):
+            valid &= (codes >= 0) & (codes < radix)
+            key = key * radix + codes
+        return np.where(valid, key, -1)
+
+    def record_key(self, record):
+        # the same key of one dict (a missing categorical has no column, a missing numeric is 0)
+        key = 0
+        for (feature, codes), radix in zip(self._value_codes.items(), self.radices):
+            key = key * radix + codes.get(record.get(feature), 0)
+        for feature in self.encoder.numeric:
+            value = record.get(feature, 0)
+            if not (isinstance(value, (int, float, np.number)) and float(value).is_integer()
+                    and 0 <= value < self.NUMERIC_RADIX):
+                return -1
+            key = key * self.NUMERIC_RADIX + int(value)
+        return key
+
+    def lookup(self, keys):
+        # table row of every key, -1 where it is not in the table
+        rows = np.searchsorted(self.keys, keys)
+        found = rows < len(self.keys)
+        found[found] = self.keys[rows[found]] == keys[found]
+        return np.where(found & (keys >= 0), rows, -1)
+
+    def get(self, key):
+        # (class index, confidence) of one key, None if it is not in the table
+        if self._entries is None:
+            self._entries = dict(zip(self.keys.tolist(), zip(self.index.tolist(), self.confidence.tolist())))
+        return self._entries.get(key)
+
+    def add(self, keys, index, confidence):
+        # new entries, keys already in the table and -1 are skipped
+        keys, first = np.unique(keys, return_index=True)
+        new = (keys >= 0) & (self.lookup(keys) < 0)
+        keys, index, confidence = keys[new], np.asarray(index)[first[new]], np.asarray(confidence)[first[new]]
+        if self._entries is not None:
+            self._entries.update(zip(keys.tolist(), zip(index.tolist(), confidence.tolist())))
+        keys = np.concatenate([self.keys, keys])
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.index = np.concatenate([self.index, index])[order]
+        self.confidence = np.concatenate([self.confidence, confidence.astype(self.confidence.dtype)])[order]
+
+
+def feature_schema(df, features=FEATURE_COLUMNS):
+    # [feature, "numeric" / "text"] pairs of the process_data output columns
+    schema = []
+    for feature in features:
+        if feature not in df:
+            schema.append([feature, "missing"])
+        elif pd.api.types.is_numeric_dtype(df[feature]) or pd.api.types.is_bool_dtype(df[feature]):
+            schema.append([feature, "numeric"])
+        else:
+            schema.append([feature, "text"])
+    return schema
+
+
+def schema_hash(schema):
+    return hashlib.sha1(json.dumps(schema).encode("utf-8")).hexdigest()
+
+
+class Model:
+
+    def __init__(self, engine, encoder, class_names, schema, dtype=np.float64, table=None):
+        self.engine = engine  # FusedMLP
+        self.encoder = encoder  # FeatureEncoder, the column vocabulary
+        self.class_names = np.asarray(class_names, dtype=object)  # output index -> label (MPP/PČR)
+        self.schema = schema  # feature_schema() of the training data
+        self.schema_hash = schema_hash(schema)
+        self.dtype = dtype
+        self.table = table  # PredictionTable, None = every row through the MLP
+
+    @property
+    def model_columns(self):
+        return self.encoder.columns
+
+    @classmethod
+    def from_sklearn(cls, mlp, scaler, model_columns, le, encoder=None, dtype=np.float64, block_rows=4096):
+        encoder = encoder if encoder is not None else FeatureEncoder.from_columns(model_columns)
+        features = [feature for feature in FEATURE_COLUMNS if feature in encoder.numeric or feature in encoder.categories]
+        schema = [[feature, "numeric" if feature in encoder.numeric else "text"] for feature in features]
+        return cls(
+            FusedMLP.from_sklearn(mlp, scaler, dtype, block_rows), encoder,
+            le.inverse_transform(mlp.classes_), schema, dtype
+        )
+
+    @classmethod
+    def load_pickles(cls, directory=".", dtype=np.float64, block_rows=4096):
+        import joblib  # (and sklearn through the pickles) only for models without a bundle
+        artifacts = {name: joblib.load(os.path.join(directory, file)) for name, file in MODEL_FILES.items()}
+        encoder_path = os.path.join(directory, ENCODER_FILE)
+        encoder = joblib.load(encoder_path) if os.path.exists(encoder_path) else None
+        return cls.from_sklearn(**artifacts, encoder=encoder, dtype=dtype, block_rows=block_rows)
+
+    @classmethod
+    def load_bundle(cls, path=BUNDLE_DIR, dtype=np.float64, block_rows=4096, mmap=True, lookup=False):
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as file:
+            manifest = json.load(file)
+        if manifest["format"] != BUNDLE_FORMAT:
+            raise ValueError(f"{path} has bundle format {manifest['format']}, expected {BUNDLE_FORMAT}")
+        if schema_hash(manifest["schema"]) != manifest["schema_hash"]:
+            raise ValueError(f"{path}: the feature schema does not match its hash")
+        unknown = [feature for feature, _ in manifest["schema"] if feature not in FEATURE_COLUMNS]
+        if unknown:
+            raise ValueError(f"{path} was trained on features {unknown} that process_data does not produce")
+
+        def array(name):
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode="r" if mmap else None)
+
+        layers = manifest["layers"]
+        engine = FusedMLP(
+            [array(f"coef_{i}") for i in range(layers)],
+            [array(f"intercept_{i}") for i in range(layers)],
+            manifest["activation"], manifest["out_activation"], dtype, block_rows
+        )
+        if np.dtype(dtype) != np.dtype(manifest["arrays"]["coef_0"]["dtype"]):
+            # converted to another dtype the weights are a private copy anyway
+            flush_subnormals(engine.coefs + engine.intercepts, dtype)
+        encoder = FeatureEncoder(manifest["columns"], manifest["categories"], manifest["numeric"])
+        model = cls(engine, encoder, manifest["classes"], manifest["schema"], dtype)
+        if lookup:
+            model.use_table()
+            # the table exported with the model, outputs of another dtype would differ slightly
+            if "table_keys" in manifest["arrays"] and np.dtype(dtype) == np.dtype(manifest["arrays"]["coef_0"]["dtype"]):
+                model.table = PredictionTable(
+                    encoder, array("table_keys"), array("table_index"), array("table_confidence"), dtype
+                )
+        return model
+
+    @classmethod
+    def load(cls, directory=".", dtype=np.float64, block_rows=4096, lookup=False):
+        # the bundle if there is one, otherwise the separate pickles;
+        # lookup: score through a PredictionTable (the bundle's one if it has it)
+        bundle = os.path.join(directory, BUNDLE_DIR)
+        if os.path.exists(os.path.join(bundle, "manifest.json")):
+            return cls.load_bundle(bundle, dtype, block_rows, lookup=lookup)
+        model = cls.load_pickles(directory, dtype, block_rows)
+        if lookup:
+            model.use_table()
+        return model
+
+    def use_table(self, table=None):
+        # score through a lookup table of the feature combinations, filled as new ones come
+        self.table = table if table is not None else PredictionTable(self.encoder, dtype=self.dtype)
+
+    def check_schema(self, df_clean):
+        schema = feature_schema(df_clean, [feature for feature, _ in self.schema])
+        if schema_hash(schema) != self.schema_hash:
+            different = [
+                f"{feature} ({kind}, model expects {expected})"
+                for (feature, kind), (_, expected) in zip(schema, self.schema) if kind != expected
+            ]
+            raise ValueError(f"data does not match the model feature schema: {', '.join(different)}")
+
+    def encode(self, df_clean):
+        # sparse one-hot matrix with exactly the training columns (not scaled, the engine does that)
+        return self.encoder.transform(df_clean, self.dtype)
+
+    def encode_records(self, records):
+        # the same matrix as encode() built straight from a list of dicts,
+        # much cheaper than pandas for the small batches of the server
+        return self.encoder.transform_records(records, self.dtype)
+
+    def _labels(self, X):
+        index, confidence = self.engine.predict(X)
+        return self.class_names[index], confidence
+
+    def predict(self, df_clean):
+        # labels (class names) and confidences from one forward pass
+        self.check_schema(df_clean)
+        if self.table is not None:
+            return self._predict_table(df_clean)
+        with profiling.stage("predict.encode", len(df_clean)):
+            X = self.encode(df_clean)
+        with profiling.stage("predict.mlp", len(df_clean)):
+            return self._labels(X)
+
+    def _predict_table(self, df_clean):
+        # the distinct keys of the chunk are looked up, one row of every key not in the table
+        # goes through the MLP (and into the table)
+        with profiling.stage("predict.lookup", len(df_clean)):
+            keys = self.table.frame_keys(df_clean)
+            inverse, distinct = pd.factorize(keys)
+            first = np.empty(len(distinct), dtype=np.intp)
+            first[inverse[::-1]] = np.arange(len(keys) - 1, -1, -1)
+            found = self.table.lookup(distinct)
+        # rows whose numeric values have no key are scored one by one (key -1)
+        missing = np.flatnonzero((found < 0) & (distinct >= 0))
+        unkeyed = np.flatnonzero(keys < 0)
+        hit = found >= 0
+        index = np.zeros(len(distinct), dtype=np.intp)
+        confidence = np.zeros(len(distinct), dtype=self.dtype)
+        index[hit], confidence[hit] = self.table.index[found[hit]], self.table.confidence[found[hit]]
+        if len(missing):
+            with profiling.stage("predict.encode", len(missing)):
+                X = self.encode(df_clean.iloc[first[missing]])
+            with profiling.stage("predict.mlp", len(missing)):
+                index[missing], confidence[missing] = self.engine.predict(X)
+            self.table.add(distinct[missing], index[missing], confidence[missing])
+        index, confidence = index[inverse], confidence[inverse]
+        if len(unkeyed):
+            index[unkeyed], confidence[unkeyed] = self.engine.predict(self.encode(df_clean.iloc[unkeyed]))
+        return self.class_names[index], confidence
+
+    def predict_records(self, records):
+        # predict() for a list of dicts with the FEATURE_COLUMNS keys
+        if self.table is None:
+            return self._labels(self.encode_records(records))
+        keys = [self.table.record_key(record) for record in records]
+        entries = [self.table.get(key) for key in keys]
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        if missing:
+            index, confidence = self.engine.predict(self.encode_records([records[i] for i in missing]))
+            self.table.add(np.array([keys[i] for i in missing], dtype=np.int64), index, confidence)
+            for i, entry in zip(missing, zip(index.tolist(), confidence.tolist())):
+                entries[i] = entry
+        index, confidence = zip(*entries) if entries else ((), ())
+        return self.class_names[np.array(index, dtype=np.intp)], np.array(confidence, dtype=self.dtype)
+
+
+def save_bundle(path, mlp, scaler, model_columns, le, encoder=None, observed=None):
+    # writes the artifacts of train.py as one bundle directory,
+    # manifest.json goes last so a bundle with a manifest is complete.
+    # observed: cleaned data (the training set), the outputs of its feature combinations
+    # are stored as the bundle's PredictionTable
+    model = Model.from_sklearn(mlp, scaler, model_columns, le, encoder)
+    os.makedirs(path, exist_ok=True)
+    arrays = {"scaler_mean": scaler.mean_, "scaler_scale": scaler.scale_}
+    for i, (w, b) in enumerate(zip(model.engine.coefs, model.engine.intercepts)):
+        arrays[f"coef_{i}"] = w
+        arrays[f"intercept_{i}"] = b
+    if observed is not None:
+        model.use_table()
+        model.predict(observed)
+        arrays["table_keys"] = model.table.keys
+        arrays["table_index"] = model.table.index
+        arrays["table_confidence"] = model.table.confidence
+    for name, values in arrays.items():
+        np.save(os.path.join(path, name + ".npy"), np.ascontiguousarray(values))
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "pipeline_version": FEATURES_FINGERPRINT,
+        "schema": model.schema,
+        "schema_hash": model.schema_hash,
+        "activation": model.engine.activation,
+        "out_activation": model.engine.out_activation,
+        "layers": len(model.engine.coefs),
+        "classes": [str(name) for name in model.class_names],
+        "columns": model.encoder.columns,
+        "categories": {
+            feature: {str(value): int(position) for value, position in mapping.items()}
+            for feature, mapping in model.encoder.categories.items()
+        },
+        "numeric": {feature: int(position) for feature, position in model.encoder.numeric.items()},
+        "arrays": {name: {"shape": list(values.shape), "dtype": str(values.dtype)} for name, values in arrays.items()},
+    }
+    with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+    return model
+
+
+def compare_with_sklearn(model, mlp, scaler, df_clean):
+    # parity check of the fused engine against scaler.transform + mlp.predict/predict_proba
+    X = model.encode(df_clean).toarray()
+    if hasattr(scaler, "feature_names_in_"):
+        X_scaled = scaler.transform(pd.DataFrame(X, columns=model.model_columns))
+    else:
+        X_scaled = scaler.transform(X)
+    sklearn_index = mlp.predict(X_scaled)
+    sklearn_confidence = mlp.predict_proba(X_scaled).max(axis=1)
+
+    index, confidence = model.engine.predict(X)
+    different_labels = int((mlp.classes_[index] != sklearn_index).sum())
+    max_difference = float(np.abs(confidence - sklearn_confidence).max()) if len(X) else 0.0
+    return different_labels, max_difference
+
+
+if __name__ == "__main__":
+    import argparse
+    import joblib
+    from clean_store import load_clean
+
+    parser = argparse.ArgumentParser(description="fused engine parity check / model bundle export")
+    parser.add_argument("data", nargs="?", default="2020_clean.npz", help="cleaned data for the parity check")
+    parser.add_argument("--export-bundle", action="store_true", help=f"write {BUNDLE_DIR}/ from the pickles")
+    args = parser.parse_args()
+
+    artifacts = {name: joblib.load(file) for name, file in MODEL_FILES.items()}
+    encoder = joblib.load(ENCODER_FILE) if os.path.exists(ENCODER_FILE) else None
+    if args.export_bundle:
+        save_bundle(BUNDLE_DIR, **artifacts, encoder=encoder)
+        print(f"model -> {BUNDLE_DIR}/")
+
+    df_clean = load_clean(args.data)
+    for dtype in (np.float64, np.float32):
+        models = {"pickles": Model.from_sklearn(**artifacts, encoder=encoder, dtype=dtype)}
+        if os.path.exists(os.path.join(BUNDLE_DIR, "manifest.json")):
+            models["bundle"] = Model.load_bundle(BUNDLE_DIR, dtype)
+        for source, model in models.items():
+            different_labels, max_difference = compare_with_sklearn(
+                model, artifacts["mlp"], artifacts["scaler"], df_clean
+            )
+            print(f"{source} {np.dtype(dtype).name}: {different_labels} different labels, "
+                  f"max confidence difference {max_difference:.2e}")
@@ -0,0 +1,61 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Parser of the violated law citations (PRAVFOR), e.g. "§ 125c odst. 1 písm. k) bod 2".
+# One compiled pattern reads all parts of the citation in one match: every part is
+# a lookahead from the start of the text, so each group is the first occurrence
+# in the text, the same as a separate re.search per part would give.
+#
+#   paragraph       first number with an optional letter   125c
+#   subsection      number after "odst." or "/"            1
+#   letter          letter + ")" after "písm.", a digit or "/"   k
+#   bracket_letter  any letter + ")"                       k
+#   point           number after "bod"                     2
+#
+# Missing parts are "". The scripts format the parts their own way:
+# data_process.get_law ("125c/k"), main.sestavit_zakon ("125c/1k)2").
+
+CITATION_PATTERN = re.compile(
+    r"(?=(?:.*?(?P<paragraph>\d+[a-z]?))?)"
+    r"(?=(?:.*?(?:odst\.?|/)\s*(?P<subsection>\d+))?)"
+    r"(?=(?:.*?(?:písm\.?|[\d/])\s*(?P<letter>[a-z])\))?)"
+    r"(?=(?:.*?(?P<bracket_letter>[a-z])\))?)"
+    r"(?=(?:.*?bod\s*(?P<point>\d+))?)",
+    re.DOTALL,
+)
+CITATION_FIELDS = list(CITATION_PATTERN.groupindex)
+
+
+def normalize(text):
+    return text.lower().strip()
+
+
+def parse_citation(text):
+    # the parts of one citation as a dict, None for a missing value (not a string)
+    if not isinstance(text, str):
+        return None
+    return CITATION_PATTERN.match(normalize(text)).groupdict(default="")
+
+
+def parse_citation_values(values):
+    # parts of the distinct citation texts in one str.extract:
+    # a frame with "text" (lower case, stripped), the CITATION_FIELDS and "valid"
+    # (False for missing values, their parts are "")
+    values = pd.Series(np.asarray(values, dtype=object))
+    valid = values.map(lambda value: isinstance(value, str))
+    text = values.where(valid, "").astype(str).str.lower().str.strip()
+    parts = text.str.extract(CITATION_PATTERN).fillna("")
+    parts.insert(0, "text", text)
+    parts["valid"] = valid.to_numpy()
+    return parts
+
+
+def map_citations(series, format_parts):
+    # format_parts(parsed frame of the distinct values) -> one label per distinct value,
+    # spread back to the rows; every distinct text is parsed once
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    labels = np.empty(len(uniques), dtype=object)
+    labels[:] = list(format_parts(parse_citation_values(uniques)))
+    return pd.Series(labels[codes], index=series.index, dtype=object)
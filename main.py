@@ -1,269 +1,252 @@
-import pprint as pp
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import datetime
 
-from pandas import Series
-from rich import print
-import numpy as np
-import re
-from sklearn.utils import resample
+from pattern_matcher import PatternMatcher
+from clean_store import save_clean
+from raw_loader import read_raw, RAW_COLUMNS
+from time_parser import parse_timestamps
+from law_parser import map_citations
 
+# Průzkum dat z roku 2023: čištění, asociační matice a vybalancování tříd.
+# Grafy a sklearn se importují až ve funkcích, které je potřebují.
 
+# Definice hlavních ulic
+main_streets = [
+    "Evropská", "Plzeňská", "Strakonická", "Jižní spojka", "Štěrboholská",
+    "5. května", "Wilsonova", "Argentinská", "Chodovská", "Liberecká",
+    "Karlovarská", "Sokolovská", "Poděbradská", "Průmyslová", "Veleslavínská",
+    "D1", "D0", "D5", "D8", "D10", "D11", "okruh", "spojka", "radiála"
+]
 
-# Načtení dat
-MHMP = pd.read_csv("MHMP_dopravni_prestupky_2023.csv")
-MHMP_copy = MHMP.copy()
-
-# Doplnění chybějícího času
-MHMP["CASSK"] = MHMP["CASSK"].fillna("00:00:00")
+# Definice značek aut
+cars = [
+    "Škoda", "Volkswagen", "Hyundai", "Toyota", "Kia",
+    "Peugeot", "Dacia", "Renault", "Ford", "Mercedes",
+    "BMW", "Audi", "Volvo", "Opel", "Mazda", "Suzuki", "Fiat", "Neuvedeno",
+    "Citroën","Seat","Honda","Nissan","IVECO","Land Rover", "Porsche", "Mitsubishi",
+    "Mini Cooper", "Lexus", "Subaru", "Chevrolet", "Jeep", "Citroen", "PASSAT"
+]
 
-# Oprava dat s chybějícími sekundami
-MHMP['CASSK'] = MHMP['CASSK'].apply(
-    lambda t: t + ':00' if len(t) == 5 else t
-)
 
-# Převod na jeden sloupec s časem
-MHMP["Time"] = MHMP["DATSK"] + " " + MHMP["CASSK"]
-MHMP['Time'] = pd.to_datetime(MHMP['Time'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+def is_workday(weekday):
+    if weekday in range(0, 5):
+        return 1
+    else:
+        return 0
 
-# Vyřazení dat s nečitelným formátem času
-time_error_mask = pd.isna(MHMP["Time"])
-MHMP = MHMP[~time_error_mask]
 
-# Nastavení času jako index
-MHMP.set_index("Time", inplace=True)
+def sestavit_zakon(casti):
+    # Jednotný formát zákona z částí citace (law_parser.parse_citation_values):
+    # paragraf, /odstavec, písmeno se závorkou a bod, např. "§ 125c odst. 1 písm. k) bod 6" -> "125c/1k)6"
+    vysledek = casti["paragraph"]
+    vysledek = vysledek + ("/" + casti["subsection"]).where(casti["subsection"] != "", "")
+    vysledek = vysledek + (casti["letter"] + ")").where(casti["letter"] != "", "")
+    vysledek = vysledek + casti["point"]
 
-# Seřazení dle času
-MHMP = MHMP.sort_index()
+    # Pokud nemáme ani paragraf, vrátíme původní (očištěný) text
+    vysledek = vysledek.where(casti["paragraph"] != "", casti["text"])
+    return vysledek.where(casti["valid"], pd.NA)
 
-# Vytvoření čistého dataframe
-data_clean = pd.DataFrame()
-data_clean.index.name = 'Time'
-data_clean["WHO"] = MHMP["OZNAM"]
 
-# Rozložení času do sloupců
-data_clean["YEAR"] = data_clean.index.year
-data_clean["MONTH"] = data_clean.index.month
-data_clean["DAY"] = data_clean.index.day
-data_clean["HOUR"] = data_clean.index.hour
+def encode_column(column):
+    legend = {}
+    def encode(value):
+        if value not in legend:
+            legend[value] = len(legend)
+        return legend[value]
 
-# Vytvoření sloupce všední den/víkend
-data_clean["WORKDAY"] = data_clean.index.weekday
-def is_workday(weekday):
-    if weekday in range(0, 5):
-        return 1
-    else:
-        return 0
-data_clean["WORKDAY"] = data_clean["WORKDAY"].apply(is_workday)
+    column = column.apply(encode)
+    return column, legend
 
-# Pokud v původním záznamu nebyl čas, musí být hodina -1
-missing_time_mask = (data_clean.index.hour == 0) & (data_clean.index.minute == 0) & (data_clean.index.second == 0)
-data_clean.loc[missing_time_mask,"HOUR"] = -1
 
-data_clean["PRAGUE"] = MHMP["PRAHA"].str.extract(r'(\d+)', expand=False)
+# Sloupce s kódy kategorií (nominální), ostatní se berou jako číselné
+NOMINAL_COLUMNS = ["WHO", "PRAGUE", "COUNTRY", "PLACE", "CAR_TYPE", "LAW"]
 
-data_clean["COUNTRY"] = MHMP["MPZ"]
-data_clean["COUNTRY"] = data_clean["COUNTRY"].fillna("UNKNOWN")
 
-counts = data_clean["COUNTRY"].value_counts(normalize=True)
+def create_corr_matrix(df, name, show_plot=True, matrix=None):
+    # Asociační matice: kategorie přes kontingenční tabulky (Cramérovo V),
+    # číselné sloupce Pearsonem, smíšené dvojice poměrem korelace eta.
+    # Kódy kategorií z encode_column nemají pořadí, korelace na nich nedávala smysl.
+    # Už spočítanou matici (stejné řádky, víc sloupců) stačí předat v matrix a jen se z ní vybere.
+    if matrix is None:
+        from association import association_matrix
 
-threshold = 0.001
+        nominal = [c for c in df.columns if c in NOMINAL_COLUMNS]
+        numeric = [c for c in df.columns if c not in NOMINAL_COLUMNS]
+        matrix = association_matrix(df, nominal, numeric)
+    corr_matrix = matrix.loc[df.columns, df.columns]
+    if not show_plot:
+        return corr_matrix
 
-mask = counts > threshold
-main_laws = counts[mask].index
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
-# Všechno, co není v 'main_laws', nahradíme hodnotou 'OTHER'
-data_clean["COUNTRY"] = data_clean["COUNTRY"].where(data_clean["COUNTRY"].isin(main_laws), "OTHER")
+    # Vizualizace pomocí heatmapy
+    plt.figure(figsize=(12, 10))
+    sns.heatmap(corr_matrix, annot=True, fmt=".2f", cmap='coolwarm', vmin=-1, vmax=1)
+    plt.title(f"Asociační matice dopravních přestupků " + name)
+    plt.show()
+    return corr_matrix
 
 
-# Vymazání části stringu po slově směr
-# Podolská směr Evropská -> Podolská
-to_delete = r'\s*směr.*'
+def clean_data(MHMP):
+    # Převod data a času na jeden sloupec s časem
+    # (chybějící čas = 00:00:00, chybějící sekundy HH:MM = HH:MM:00, viz time_parser.py)
+    MHMP["Time"] = parse_timestamps(MHMP["DATSK"], MHMP["CASSK"]).astype("datetime64[ns]")
 
-MHMP["MISTOSK"] = MHMP["MISTOSK"].str.replace(
-    to_delete,
-    '',
-    regex=True,
-    case=False
-)
+    # Vyřazení dat s nečitelným formátem času
+    time_error_mask = pd.isna(MHMP["Time"])
+    MHMP = MHMP[~time_error_mask]
 
-# Definice hlavních ulic
-main_streets = [
-    "Evropská", "Plzeňská", "Strakonická", "Jižní spojka", "Štěrboholská",
-    "5. května", "Wilsonova", "Argentinská", "Chodovská", "Liberecká",
-    "Karlovarská", "Sokolovská", "Poděbradská", "Průmyslová", "Veleslavínská",
-    "D1", "D0", "D5", "D8", "D10", "D11", "okruh", "spojka", "radiála"
-]
-main_streets = '|'.join(main_streets)
+    # Nastavení času jako index
+    MHMP.set_index("Time", inplace=True)
 
-# Určení typu místa
-data_clean["PLACE"] = {}
-square_mask = MHMP["MISTOSK"].str.contains("náměstí", case=False, na=False)
-tunel_mask = MHMP["MISTOSK"].str.contains("tunel", case=False, na=False)
-main_street_mask = MHMP["MISTOSK"].str.contains(main_streets, case=False, na=False)
+    # Seřazení dle času
+    MHMP = MHMP.sort_index()
 
-# Vyplnění typu místa
-data_clean["PLACE"] = "OTHER"
-data_clean.loc[square_mask, "PLACE"] = "SQUARE"
-data_clean.loc[tunel_mask, "PLACE"] = "TUNNEL"
-data_clean.loc[main_street_mask, "PLACE"] = "MAIN_STREET"
+    # Vytvoření čistého dataframe
+    data_clean = pd.DataFrame()
+    data_clean.index.name = 'Time'
+    data_clean["WHO"] = MHMP["OZNAM"]
 
-# Definice značek aut
-cars = [
-    "Škoda", "Volkswagen", "Hyundai", "Toyota", "Kia",
-    "Peugeot", "Dacia", "Renault", "Ford", "Mercedes",
-    "BMW", "Audi", "Volvo", "Opel", "Mazda", "Suzuki", "Fiat", "Neuvedeno",
-    "Citroën","Seat","Honda","Nissan","IVECO","Land Rover", "Porsche", "Mitsubishi",
-    "Mini Cooper", "Lexus", "Subaru", "Chevrolet", "Jeep", "Citroen", "PASSAT"
-]
+    # Rozložení času do sloupců
+    data_clean["YEAR"] = data_clean.index.year
+    data_clean["MONTH"] = data_clean.index.month
+    data_clean["DAY"] = data_clean.index.day
+    data_clean["HOUR"] = data_clean.index.hour
 
-data_clean["CAR_TYPE"] = {}
-for car in cars:
-    mask = MHMP["TOVZN"].str.contains(car, case=False, na=False)
-    data_clean.loc[mask, "CAR_TYPE"] = car
-mask_unspecified_car = (MHMP["TOVZN"] == "Neuvedeno") | (pd.isna(MHMP["TOVZN"]))
-data_clean.loc[mask_unspecified_car, "CAR_TYPE"] = "UNSPECIFIED"
-data_clean["CAR_TYPE"] = data_clean["CAR_TYPE"].fillna("OTHER")
+    # Vytvoření sloupce všední den/víkend
+    data_clean["WORKDAY"] = data_clean.index.weekday
+    data_clean["WORKDAY"] = data_clean["WORKDAY"].apply(is_workday)
 
-mask_car_other = data_clean["CAR_TYPE"] == "OTHER"
+    # Pokud v původním záznamu nebyl čas, musí být hodina -1
+    missing_time_mask = (data_clean.index.hour == 0) & (data_clean.index.minute == 0) & (data_clean.index.second == 0)
+    data_clean.loc[missing_time_mask,"HOUR"] = -1
 
-# Spočítáme relativní četnosti (0.0 až 1.0)
-counts = data_clean["CAR_TYPE"].value_counts(normalize=True)
+    data_clean["PRAGUE"] = MHMP["PRAHA"].str.extract(r'(\d+)', expand=False)
 
-# Stanovíme limit (např. 1 %, tedy 0.01)
-threshold = 0.01
+    data_clean["COUNTRY"] = MHMP["MPZ"]
+    data_clean["COUNTRY"] = data_clean["COUNTRY"].fillna("UNKNOWN")
 
-# Identifikujeme značky, které limit splňují
-mask = counts > threshold
-main_types = counts[mask].index
+    counts = data_clean["COUNTRY"].value_counts(normalize=True)
 
-# Všechno, co není v 'main_types', nahradíme hodnotou 'OTHER'
-data_clean["CAR_TYPE"] = data_clean["CAR_TYPE"].where(data_clean["CAR_TYPE"].isin(main_types), "OTHER")
+    threshold = 0.001
 
-# Rozdělení FIRMA/OSOBA
-mask_person = MHMP["OSOBA"] == "ANO"
-mask_firm = MHMP["FIRMA"] == "ANO"
-data_clean["OSOBA"] = 0
-data_clean["FIRMA"] = 0
-data_clean.loc[mask_person, "OSOBA"] = 1
-data_clean.loc[mask_firm, "FIRMA"] = 1
+    mask = counts > threshold
+    main_laws = counts[mask].index
 
-def sjednotit_zakon(text):
-    if not isinstance(text, str):
-        return pd.NA
+    # Všechno, co není v 'main_laws', nahradíme hodnotou 'OTHER'
+    data_clean["COUNTRY"] = data_clean["COUNTRY"].where(data_clean["COUNTRY"].isin(main_laws), "OTHER")
 
-    # 1. Základní očištění (malá písmena)
-    text = text.lower().strip()
 
-    # --- EXTRAKCE DAT POMOCÍ REGEXŮ ---
+    # Vymazání části stringu po slově směr
+    # Podolská směr Evropská -> Podolská
+    to_delete = r'\s*směr.*'
 
-    # A) Paragraf (hledá číslo následované volitelně písmenem, např. 125c, 125, 16)
-    # Ignorujeme znak § a hledáme hned na začátku nebo po mezeře
-    paragraf_match = re.search(r'(?:§\s*|^)?(\d+[a-z]?)', text)
-    paragraf = paragraf_match.group(1) if paragraf_match else ""
+    MHMP["MISTOSK"] = MHMP["MISTOSK"].str.replace(
+        to_delete,
+        '',
+        regex=True,
+        case=False
+    )
 
-    # B) Odstavec (hledá číslo po "odst." nebo po lomítku "/")
-    # Hledáme vzor: buď slovo 'odst' nebo lomítko, za ním volitelně mezera a číslice
-    odstavec_match = re.search(r'(?:odst\.?|/)\s*(\d+)', text)
-    odstavec = odstavec_match.group(1) if odstavec_match else ""
+    # Určení typu místa jedním průchodem textu
+    # Dříve platilo poslední přiřazení (hlavní tah > tunel > náměstí), proto je pořadí vzorů takové
+    place_matcher = PatternMatcher(
+        main_streets + ["tunel", "náměstí"],
+        labels=["MAIN_STREET"] * len(main_streets) + ["TUNNEL", "SQUARE"]
+    )
+    data_clean["PLACE"] = place_matcher.match_series(MHMP["MISTOSK"], "OTHER")
 
-    # C) Písmeno (hledá písmeno a-z následované závorkou)
-    # Může být po "písm.", nebo přímo nalepené za číslem (např. /1k)
-    # Závorka ) je klíčový identifikátor pro písmeno v tomto datasetu
-    pismeno_match = re.search(r'(?:písm\.?|[\d/])\s*([a-z])\)', text)
-    pismeno = pismeno_match.group(1) if pismeno_match else ""
+    # Při více shodách vyhrávala poslední značka ze seznamu, matcher proto dostane seznam obráceně
+    car_matcher = PatternMatcher(cars[::-1])
+    data_clean["CAR_TYPE"] = car_matcher.match_series(MHMP["TOVZN"])
+    mask_unspecified_car = (MHMP["TOVZN"] == "Neuvedeno") | (pd.isna(MHMP["TOVZN"]))
+    data_clean.loc[mask_unspecified_car, "CAR_TYPE"] = "UNSPECIFIED"
+    data_clean["CAR_TYPE"] = data_clean["CAR_TYPE"].fillna("OTHER")
 
-    # D) Bod (hledá číslo po slově "bod")
-    bod_match = re.search(r'bod\s*(\d+)', text)
-    bod = bod_match.group(1) if bod_match else ""
+    mask_car_other = data_clean["CAR_TYPE"] == "OTHER"
 
-    # --- SESTAVENÍ VÝSLEDNÉHO FORMÁTU ---
+    # Spočítáme relativní četnosti (0.0 až 1.0)
+    counts = data_clean["CAR_TYPE"].value_counts(normalize=True)
 
-    # Pokud nemáme ani paragraf, vrátíme původní text nebo chybu
-    if not paragraf:
-        return text
+    # Stanovíme limit (např. 1 %, tedy 0.01)
+    threshold = 0.01
 
-    vysledek = paragraf
+    # Identifikujeme značky, které limit splňují
+    mask = counts > threshold
+    main_types = counts[mask].index
 
-    if odstavec:
-        vysledek += f"/{odstavec}"
+    # Všechno, co není v 'main_types', nahradíme hodnotou 'OTHER'
+    data_clean["CAR_TYPE"] = data_clean["CAR_TYPE"].where(data_clean["CAR_TYPE"].isin(main_types), "OTHER")
 
-    if pismeno:
-        vysledek += f"{pismeno})"
+    # Rozdělení FIRMA/OSOBA
+    mask_person = MHMP["OSOBA"] == "ANO"
+    mask_firm = MHMP["FIRMA"] == "ANO"
+    data_clean["OSOBA"] = 0
+    data_clean["FIRMA"] = 0
+    data_clean.loc[mask_person, "OSOBA"] = 1
+    data_clean.loc[mask_firm, "FIRMA"] = 1
 
-    if bod:
-        # Přilepíme bod na konec (podle zadání "j)6").
-        # Pokud byste chtěl mezeru, stačí změnit na f" {bod}"
-        vysledek += f"{bod}"
+    # Každý různý text citace se parsuje jen jednou
+    data_clean["LAW"] = map_citations(MHMP["PRAVFOR"], sestavit_zakon)
 
-    return vysledek
+    # Spočítáme relativní četnosti (0.0 až 1.0)
+    counts = data_clean["LAW"].value_counts(normalize=True)
 
-data_clean["LAW"] = MHMP["PRAVFOR"].apply(sjednotit_zakon)
+    # Stanovíme limit (např. 1 %, tedy 0.01)
+    threshold = 0.001
 
-# Spočítáme relativní četnosti (0.0 až 1.0)
-counts = data_clean["LAW"].value_counts(normalize=True)
+    # Identifikujeme zákony, které limit splňují
+    mask = counts > threshold
+    main_laws = counts[mask].index
 
-# Stanovíme limit (např. 1 %, tedy 0.01)
-threshold = 0.001
+    # Všechno, co není v 'main_laws', nahradíme hodnotou 'OTHER'
+    data_clean["LAW"] = data_clean["LAW"].where(data_clean["LAW"].isin(main_laws), "OTHER")
 
-# Identifikujeme zákony, které limit splňují
-mask = counts > threshold
-main_laws = counts[mask].index
+    df_legend = {}
+    data_clean["LAW"], df_legend["LAW"] = encode_column(data_clean["LAW"])
+    data_clean["CAR_TYPE"], df_legend["CAR_TYPE"] = encode_column(data_clean["CAR_TYPE"])
+    data_clean["COUNTRY"], df_legend["COUNTRY"] = encode_column(data_clean["COUNTRY"])
+    data_clean["PLACE"], df_legend["PLACE"] = encode_column(data_clean["PLACE"])
+    data_clean["WHO"], df_legend["WHO"] = encode_column(data_clean["WHO"])
 
-# Všechno, co není v 'main_laws', nahradíme hodnotou 'OTHER'
-data_clean["LAW"] = data_clean["LAW"].where(data_clean["LAW"].isin(main_laws), "OTHER")
+    data_clean = data_clean.drop(columns="YEAR")
+    return data_clean, df_legend
 
-df_legend = {}
-def encode_column(column):
-    legend = {}
-    def encode(value):
-        if value not in legend:
-            legend[value] = len(legend)
-        return legend[value]
 
-    column = column.apply(encode)
-    return column, legend
+def balance_classes(data_clean, df_legend, seed=42):
+    from sampling import sample_frame
 
-data_clean["LAW"], df_legend["LAW"] = encode_column(data_clean["LAW"])
-data_clean["CAR_TYPE"], df_legend["CAR_TYPE"] = encode_column(data_clean["CAR_TYPE"])
-data_clean["COUNTRY"], df_legend["COUNTRY"] = encode_column(data_clean["COUNTRY"])
-data_clean["PLACE"], df_legend["PLACE"] = encode_column(data_clean["PLACE"])
-data_clean["WHO"], df_legend["WHO"] = encode_column(data_clean["WHO"])
+    # Downsample většinové třídy (MPP) na počet menšinové (PČR) jedním průchodem,
+    # bez filtrovaných kopií obou tříd; výběr je pro daný seed vždy stejný
+    # a řádky zůstávají v časovém pořadí
+    tridy = [df_legend["WHO"]["MPP"], df_legend["WHO"]["PČR"]]
+    return sample_frame(data_clean, "WHO", ratio=1.0, classes=tridy, seed=seed)
 
-data_clean = data_clean.drop(columns="YEAR")
 
-def create_corr_matrix(df, name):
-    # Výpočet korelační matice
-    corr_matrix = df.corr()
+def main(path="MHMP_dopravni_prestupky_2023.csv", out_path="data_clean.npz", show_plot=True):
+    # Načtení dat (jen potřebné sloupce, FIRMA/OSOBA a datum s časem jako kategorie,
+    # ostatní jako řetězce kvůli .apply a fillna v clean_data)
+    MHMP = read_raw(path, columns=RAW_COLUMNS + ["OSOBA"], categories=["FIRMA", "OSOBA", "DATSK", "CASSK"])
 
-    # Vizualizace pomocí heatmapy
-    plt.figure(figsize=(12, 10))
-    sns.heatmap(corr_matrix, annot=True, fmt=".2f", cmap='coolwarm', vmin=-1, vmax=1)
-    plt.title(f"Korelační matice dopravních přestupků " + name)
-    plt.show()
+    data_clean, df_legend = clean_data(MHMP)
 
-create_corr_matrix(data_clean, "VYČIŠTĚNÁ DATA")
+    create_corr_matrix(data_clean, "VYČIŠTĚNÁ DATA", show_plot)
 
-# Rozdělení podle tříd
-df_mpp = data_clean[data_clean.WHO == df_legend["WHO"]["MPP"]]  # Předpokládám klíč "MPP" nebo "MESTSKA..."
-df_pcr = data_clean[data_clean.WHO == df_legend["WHO"]["PČR"]]  # Předpokládám klíč "PCR"
+    data_clean = balance_classes(data_clean, df_legend)
 
-# Downsample většinové třídy (MPP)
-df_mpp_downsampled = resample(df_mpp,
-                              replace=False,  # nevracet vzorky
-                              n_samples=len(df_pcr),  # počet jako menšinová třída
-                              random_state=42)
+    balanced_matrix = create_corr_matrix(data_clean, "VYBALANCOVANÁ DATA (MPP : PČR = 1 : 1)", show_plot)
 
-# Spojení zpět
-data_clean = pd.concat([df_mpp_downsampled, df_pcr])
+    # Zahození nepodstatných dat
+    data_clean = data_clean.drop(columns=["MONTH", "DAY", "HOUR", "WORKDAY"])
 
-create_corr_matrix(data_clean, "VYBALANCOVANÁ DATA (MPP : PČR = 1 : 1)")
+    # Stejné řádky jako u vybalancovaných dat, matice se jen zmenší
+    create_corr_matrix(data_clean, "VYBALANCOVÁNO + SMAZÁNY NEPODSTATNÉ SLOUPCE", show_plot, balanced_matrix)
 
-# Zahození nepodstatných dat
-data_clean = data_clean.drop(columns=["MONTH", "DAY", "HOUR", "WORKDAY"])
+    # Uložení s typy sloupců a číselníky kategorií (místo data_clean.csv)
+    save_clean(data_clean, out_path)
+    return data_clean, df_legend
 
-create_corr_matrix(data_clean, "VYBALANCOVÁNO + SMAZÁNY NEPODSTATNÉ SLOUPCE")
 
-data_clean.to_csv("data_clean.csv")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from data_process import process_data, FeatureCache
+from raw_loader import read_raw, read_raw_rows, row_offsets, check_raw_columns, read_header
+
+# Parallel version of process_data over several MHMP files (years).
+# Pass 1 counts MPZ values per file, the counts are merged so that get_country thresholds
+# on the frequencies of all files together; it also counts the lines of every file and
+# records the byte offset of every shard_rows-th one.
+# Pass 2 splits every file into line ranges and cleans them in a process pool, every worker
+# reads only the bytes of its range, so each line of the file is parsed once whatever the
+# number of shards.
+# The shards are put back together in file and line order, so the result is the same as
+# process_data(pd.concat([read_raw(p) for p in paths], ignore_index=True))
+# whatever the number of workers.
+# Row ranges are counted in lines, so records with line breaks inside quotes are not supported.
+
+_worker_cache = None
+
+
+def _init_worker(cache_path):
+    # every worker loads the feature cache once (read only, the workers never save it)
+    global _worker_cache
+    _worker_cache = FeatureCache(cache_path) if cache_path else None
+
+
+def _count_file(path, shard_rows):
+    # rows (lines), MPZ counts and the byte offsets of the shards of one file;
+    # rows and offsets come from the same scan, so the shards cover exactly the file's lines
+    counts = pd.Series(dtype=float)
+    for chunk in pd.read_csv(path, usecols=["MPZ"], chunksize=500_000):
+        counts = counts.add(chunk["MPZ"].value_counts(), fill_value=0)
+    offsets, rows = row_offsets(path, shard_rows)
+    return rows, counts, offsets
+
+
+def _process_shard(shard, country_frequencies):
+    path, header, start, end = shard
+    chunk = read_raw_rows(path, header, start, end)
+    return process_data(chunk, cache=_worker_cache, country_frequencies=country_frequencies)
+
+
+def make_shards(paths, row_counts, shard_offsets, shard_rows):
+    # (path, header, byte offset of the first row, byte offset after the last one or None for
+    # the end of the file); shard_offsets = the offsets of row_offsets(path, shard_rows) of every file
+    shards = []
+    for path, rows, byte_offsets in zip(paths, row_counts, shard_offsets):
+        check_raw_columns(path)
+        header = read_header(path)
+        starts = byte_offsets[:len(range(0, rows, shard_rows))]
+        for start, end in zip(starts, starts[1:] + [None]):
+            shards.append((path, header, start, end))
+    return shards
+
+
+def process_files_parallel(paths, workers=None, shard_rows=1_000_000, cache_path=None):
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cache_path,)) as pool:
+        # pass 1: rows and MPZ counts per file, merged into one frequency table
+        file_stats = list(pool.map(_count_file, paths, [shard_rows] * len(paths)))
+        row_counts = [rows for rows, _, _ in file_stats]
+        counts = pd.Series(dtype=float)
+        for _, file_counts, _ in file_stats:
+            counts = counts.add(file_counts, fill_value=0)
+        country_frequencies = counts / counts.sum()
+
+        # pass 2: the shards, map keeps their order
+        shards = make_shards(paths, row_counts, [offsets for _, _, offsets in file_stats], shard_rows)
+        parts = list(pool.map(_process_shard, shards, [country_frequencies] * len(shards)))
+
+    if not parts:
+        return process_data(pd.concat([read_raw(path) for path in paths], ignore_index=True))
+    # blank lines are skipped by the shards, the index is counted again like the serial concat does
+    return pd.concat(parts, ignore_index=True)
+
+
+def compare_with_serial(paths, workers=None, shard_rows=100_000):
+    # parity check of the parallel run against the serial one
+    serial = process_data(pd.concat([read_raw(path) for path in paths], ignore_index=True))
+    parallel = process_files_parallel(paths, workers, shard_rows)
+    return serial.equals(parallel)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="clean several MHMP files in parallel")
+    parser.add_argument("output", help="cleaned output, .npz or .csv")
+    parser.add_argument("inputs", nargs="+", help="MHMP_dopravni_prestupky_20xx.csv files")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shard-rows", type=int, default=1_000_000)
+    parser.add_argument("--cache", default="feature_cache.pkl", help="feature cache to read")
+    args = parser.parse_args()
+
+    df_clean = process_files_parallel(args.inputs, args.workers, args.shard_rows, args.cache)
+    if args.output.endswith(".npz"):
+        from clean_store import save_clean
+        save_clean(df_clean, args.output)
+    else:
+        df_clean.to_csv(args.output)
+    print(f"{len(df_clean)} rows -> {args.output}")
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+
+class PatternMatcher:
+    # Aho-Corasick automaton over lowercased patterns.
+    # One pass over the text finds every pattern in it, and the pattern that comes
+    # first in the list wins (the same result as checking the list one by one).
+
+    def __init__(self, patterns, labels=None):
+        self.patterns = list(patterns)
+        self.labels = list(labels) if labels is not None else self.patterns
+        if len(self.labels) != len(self.patterns):
+            raise ValueError("patterns and labels must have the same length")
+
+        # trie of the patterns, out[state] = smallest pattern index ending in that state
+        self._goto = [{}]
+        self._out = [len(self.patterns)]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern.lower():
+                if ch not in self._goto[state]:
+                    self._goto.append({})
+                    self._out.append(len(self.patterns))
+                    self._goto[state][ch] = len(self._goto) - 1
+                state = self._goto[state][ch]
+            self._out[state] = min(self._out[state], index)
+
+        self._build_transitions()
+
+    def _build_transitions(self):
+        # breadth first over the trie, every state gets full transitions (through the
+        # failure links) so that matching is a single dict lookup per character
+        fail = [0] * len(self._goto)
+        self._delta = [dict(self._goto[0])]
+        self._delta.extend({} for _ in range(len(self._goto) - 1))
+        queue = list(self._goto[0].values())
+        for state in queue:
+            fail_state = fail[state]
+            self._out[state] = min(self._out[state], self._out[fail_state])
+            # characters without an edge continue like the failure state does
+            delta = dict(self._delta[fail_state])
+            for ch, child in self._goto[state].items():
+                fail[child] = self._delta[fail_state].get(ch, 0)
+                delta[ch] = child
+                queue.append(child)
+            self._delta[state] = delta
+
+    def find(self, text):
+        # index of the first pattern (in list order) that occurs in text, -1 if none
+        delta = self._delta
+        out = self._out
+        best = len(self.patterns)
+        state = 0
+        for ch in text.lower():
+            state = delta[state].get(ch, 0)
+            if out[state] < best:
+                best = out[state]
+                if best == 0:
+                    break
+        return best if best < len(self.patterns) else -1
+
+    def match(self, text, default=None):
+        # label of the first pattern found in text, default if none (or not a string)
+        if not isinstance(text, str):
+            return default
+        index = self.find(text)
+        return self.labels[index] if index >= 0 else default
+
+    def match_series(self, series, default=None):
+        # match() for a whole column, every distinct value is matched only once
+        codes, uniques = pd.factorize(series, use_na_sentinel=False)
+        labels = np.array([self.match(value, default) for value in uniques], dtype=object)
+        return pd.Series(labels[codes], index=series.index, dtype=object)
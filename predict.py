@@ -1,92 +1,73 @@
-import pandas as pd
-import joblib
-from data_process import process_data
-from sklearn.metrics import classification_report, confusion_matrix
-
-# load model and artifacts
-print("Loading model and tools...")
-mlp = joblib.load('model_mlp.pkl')
-scaler = joblib.load('model_scaler.pkl')
-model_columns = joblib.load('model_columns.pkl')
-le = joblib.load('model_le.pkl')  # LabelEncoder (maps 0/1 back to class names)
-
-# load original dataset
-"""print("Loading dataset...")
-df_orig = pd.read_csv("MHMP_dopravni_prestupky_2021.csv")
-
-# process data
-print("Processing data...")
-df_clean = process_data(df_orig)"""
-
-# or load already cleaned data
-df_clean = pd.read_csv("2020_clean.csv")
-
-# Store the actual values for later comparison
-reality_text = df_clean["OZNAM"]
-
-# Prepare model inputs (drop the target column)
-df_input = df_clean.drop(columns=["OZNAM"])
-# Ensure columns match the training structure exactly
-df_encoded = pd.get_dummies(df_input)
-df_ready = df_encoded.reindex(columns=model_columns, fill_value=0)
-df_scaled = scaler.transform(df_ready)
-
-print("Running predictions...")
-prediction_index = mlp.predict(df_scaled)
-
-# Convert numerical predictions (0/1) back to text labels (e.g., MPP/PČR)
-prediction_text = le.inverse_transform(prediction_index)
-
-# Get prediction confidence scores (maximum probability)
-probability = mlp.predict_proba(df_scaled).max(axis=1)
-
-# --- COMPARISON ---
-# Create a results DataFrame for evaluation
-results = pd.DataFrame({
-    "ACTUAL": reality_text,
-    "PREDICTED": prediction_text,
-    "CONFIDENCE": probability,
-    # Context columns to understand the nature of the violation
-    "SEASON" : df_clean["SEASON"],
-    "DAY_TIME" : df_clean["DAY_TIME"],
-    "PRAGUE" : df_clean["PRAGUE"],
-    "PLACE_TYPE" : df_clean["PLACE_TYPE"],
-    "CAR_TYPE" : df_clean["CAR_TYPE"],
-    "LAW": df_clean["LAW_CLEAN"],
-    "IS_FIRM" : df_clean["IS_FIRM"],
-})
-
-# Add a boolean column indicating if the prediction was correct
-results["MATCH"] = results["ACTUAL"] == results["PREDICTED"]
-
-# --- STATISTICS ---
-total_count = len(results)
-correct_count = results["MATCH"].sum()
-accuracy = (correct_count / total_count) * 100
-
-print(f"\n==========================================")
-print(f"FULL DATASET EVALUATION RESULTS")
-print(f"==========================================")
-print(f"Total rows:      {total_count}")
-print(f"Correctly pred.: {correct_count}")
-print(f"Errors:          {total_count - correct_count}")
-print(f"Accuracy:        {accuracy:.2f} %")
-print(f"==========================================\n")
-
-# --- ERROR ANALYSIS (Misclassified instances) ---
-# Filter only rows where the model made a mistake
-errors = results[results["MATCH"] == False]
-
-if not errors.empty:
-    print("Sample of 5 misclassified instances:")
-    print(errors[["ACTUAL", "PREDICTED", "CONFIDENCE", "LAW", "CAR_TYPE"]].head(5))
-
-    # Save errors to CSV for manual inspection in Excel
-    errors.to_csv("model_errors.csv", index=False)
-    print("\nList of all errors saved to 'model_errors.csv'.")
-else:
-    print("Congratulations! The model made zero errors.")
-
-print("\n--- DETAIL CLASSIFICATION REPORT ---")
-print(classification_report(results["ACTUAL"], results["PREDICTED"], digits=4))
-print("==========================================\n")
\ No newline at end of file
+import sys
+
+from inference import Model
+from evaluation import StreamingEvaluation
+import profiling
+
+# the data is scored chunk by chunk, only the chunk and the running statistics are in memory
+CHUNK_ROWS = 500_000
+# features of raw files are kept here and only new / changed rows are processed again
+STORE_DIR = "feature_store"
+
+
+def iter_input_chunks(path, chunk_rows=CHUNK_ROWS, store_dir=STORE_DIR):
+    # already cleaned data (.npz, python clean_store.py 2020_clean.csv converts the old CSV)
+    # or an original MHMP csv: through the feature store, or without one (store_dir empty)
+    # through process_data chunk by chunk
+    from data_process import FEATURES_FINGERPRINT
+
+    if path.endswith(".npz"):
+        from clean_store import iter_clean_chunks, read_clean_metadata
+        if read_clean_metadata(path)["pipeline_version"] != FEATURES_FINGERPRINT:
+            print(f"WARNING: {path} was not written by the current feature code, "
+                  f"its features may be stale (score the raw MHMP file instead)")
+        return iter_clean_chunks(path, chunk_rows)
+
+    if store_dir:
+        from feature_store import FeatureStore
+        store = FeatureStore(store_dir)
+        result = store.refresh(path)
+        print(f"Features of {path}: {result['rows']} rows, "
+              f"{result['processed_rows']} of them processed now")
+        return store.iter_chunks(path)
+
+    from data_process import iter_processed_chunks
+    print("Loading and processing dataset...")
+    return iter_processed_chunks(path, chunksize=chunk_rows)
+
+
+def main(path="2020_clean.npz", model_dir=".", chunk_rows=CHUNK_ROWS, errors_path="model_errors.csv",
+         store_dir=STORE_DIR, lookup=True):
+    # load model and artifacts
+    # (model_bundle/ if it exists, otherwise MLP + scaler + column list + LabelEncoder pickles;
+    # the scaler is folded into the first MLP layer, the feature schema is checked on every chunk).
+    # lookup: only the distinct feature combinations go through the MLP, every other row
+    # is a lookup in the model's PredictionTable (the same labels and confidences)
+    print("Loading model and tools...")
+    with profiling.stage("predict.load_model"):
+        model = Model.load(model_dir, lookup=lookup)
+
+    chunks = profiling.iter_stage("predict.read", iter_input_chunks(path, chunk_rows, store_dir))
+
+    # --- COMPARISON ---
+    # Counts of actual/predicted pairs, misclassified instances go to model_errors.csv
+    # (with the context columns to understand the nature of the violation)
+    evaluation = StreamingEvaluation(errors_path)
+
+    print("Running predictions...")
+    for df_chunk in chunks:
+        # One forward pass gives both the text labels (e.g., MPP/PČR)
+        # and the prediction confidence scores (maximum probability)
+        prediction_text, probability = model.predict(df_chunk)
+        with profiling.stage("predict.evaluate", len(df_chunk)):
+            evaluation.update(df_chunk, prediction_text, probability)
+
+    # --- STATISTICS, ERROR ANALYSIS AND DETAIL CLASSIFICATION REPORT ---
+    with profiling.stage("predict.report"):
+        evaluation.print_report()
+    return evaluation
+
+
+if __name__ == "__main__":
+    # python predict.py [2020_clean.npz | MHMP_dopravni_prestupky_2021.csv]
+    main(*sys.argv[1:2])
@@ -0,0 +1,236 @@
+import os
+import json
+import math
+import time
+import queue
+import argparse
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from data_process import process_data, FEATURE_COLUMNS
+from inference import Model
+
+# Long running scoring service, the model is loaded once at startup.
+#
+#   POST /predict  {"records": [{...}, ...]}
+#                  records are either cleaned features (SEASON, DAY_TIME, ...)
+#                  or raw MHMP rows (DATSK, CASSK, PRAHA, ...), those go through process_data
+#   GET  /health
+#
+# Concurrent requests are grouped into micro-batches, one batch = one scaler + MLP call.
+
+
+class MicroBatcher:
+
+    def __init__(self, model, max_batch=1024, max_wait=0.0):
+        self.model = model
+        self.max_batch = max_batch  # rows
+        # seconds the first request of a batch waits for others, with 0 a batch is
+        # whatever queued up while the previous one was being scored
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def predict(self, records):
+        # called from the request threads with a list of feature records,
+        # blocks until the batch with them is scored
+        job = {"records": records, "done": threading.Event()}
+        self._queue.put(job)
+        job["done"].wait()
+        if "error" in job:
+            raise job["error"]
+        return job["labels"], job["confidence"]
+
+    def _collect(self):
+        jobs = [self._queue.get()]
+        rows = len(jobs[0]["records"])
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                job = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            jobs.append(job)
+            rows += len(job["records"])
+        return jobs
+
+    def _score(self, jobs):
+        records = [record for job in jobs for record in job["records"]]
+        labels, confidence = self.model.predict_records(records)
+        start = 0
+        for job in jobs:
+            end = start + len(job["records"])
+            job["labels"], job["confidence"] = labels[start:end], confidence[start:end]
+            start = end
+
+    def _run(self):
+        while True:
+            jobs = self._collect()
+            try:
+                self._score(jobs)
+            except Exception as error:
+                # something check_records let through, the jobs are scored one by one
+                # so only the request with the bad record gets the error
+                if len(jobs) == 1:
+                    jobs[0]["error"] = error
+                else:
+                    for job in jobs:
+                        try:
+                            self._score([job])
+                        except Exception as job_error:
+                            job["error"] = job_error
+            for job in jobs:
+                job["done"].set()
+
+
+JSON_SCALARS = (str, int, float, bool, type(None))
+
+
+def is_finite_number(value):
+    # json.loads gives inf / nan for 1e400 / NaN, and ints of any size (10**400 does not fit a float)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    try:
+        return math.isfinite(float(value))
+    except OverflowError:
+        return False
+
+
+def check_records(records, schema):
+    # ValueError (-> 400) for input the model cannot take, checked before the records
+    # join a micro-batch, where one bad record would fail the other requests' records too.
+    # schema: the model's [feature, "numeric" / "text"] pairs
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise ValueError("records must be a list of objects")
+    kinds = dict(schema)
+    for i, record in enumerate(records):
+        for column, value in record.items():
+            if kinds.get(column) == "numeric":
+                if not is_finite_number(value):
+                    raise ValueError(f"record {i}: {column} must be a finite number, not {value!r}")
+            elif column in kinds:
+                if not isinstance(value, (str, type(None))):
+                    raise ValueError(f"record {i}: {column} must be a string or null, not {value!r}")
+            elif not isinstance(value, JSON_SCALARS):
+                raise ValueError(f"record {i}: {column} must be a string, number or null, not {value!r}")
+            elif isinstance(value, (int, float)) and not isinstance(value, bool) and not is_finite_number(value):
+                raise ValueError(f"record {i}: {column} must be a finite number, not {value!r}")
+
+
+def records_to_features(records, schema):
+    # cleaned records are passed as they are, raw MHMP rows are cleaned first
+    check_records(records, schema)
+    if all(all(column in record for column in FEATURE_COLUMNS) for record in records):
+        return records
+    return process_data(pd.DataFrame.from_records(records)).to_dict("records")
+
+
+class PredictHandler(BaseHTTPRequestHandler):
+    batcher = None
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate writes, with Nagle each response would wait for an ACK
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            records = payload["records"] if isinstance(payload, dict) else payload
+            records = records_to_features(records, self.batcher.model.schema)
+        except (ValueError, KeyError, TypeError) as error:
+            # bad JSON, missing columns, wrong value types, unreadable dates
+            self._send_json(400, {"error": f"{type(error).__name__}: {error}"})
+            return
+        except Exception as error:
+            self._send_json(500, {"error": f"{type(error).__name__}: {error}"})
+            return
+
+        if not records:
+            self._send_json(200, {"predictions": []})
+            return
+        try:
+            labels, confidence = self.batcher.predict(records)
+        except Exception as error:
+            # the connection stays usable, the client gets the reason instead of a reset
+            self._send_json(500, {"error": f"{type(error).__name__}: {error}"})
+            return
+        predictions = [
+            {"label": str(label), "confidence": float(value)}
+            for label, value in zip(labels, np.asarray(confidence))
+        ]
+        self._send_json(200, {"predictions": predictions})
+
+    def address_string(self):
+        # unix sockets have no client address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        # no line per request, it would cost more than the scoring
+        pass
+
+
+class UnixPredictHandler(PredictHandler):
+    # TCP_NODELAY does not exist for unix sockets
+    disable_nagle_algorithm = False
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class ScoringHTTPServer(ThreadingHTTPServer):
+    # the default listen backlog of 5 drops connections under load
+    request_queue_size = 1024
+
+
+def make_server(model, host="127.0.0.1", port=8000, unix_socket=None, max_batch=1024, max_wait=0.0):
+    PredictHandler.batcher = MicroBatcher(model, max_batch, max_wait)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        return ThreadingUnixHTTPServer(unix_socket, UnixPredictHandler)
+    return ScoringHTTPServer((host, port), PredictHandler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MLP scoring server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", default=None, help="listen on a unix socket instead of TCP")
+    parser.add_argument("--model-dir", default=".")
+    parser.add_argument("--max-batch", type=int, default=1024, help="rows per micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=0.0, help="how long a batch waits for more requests")
+    parser.add_argument("--no-lookup", action="store_true",
+                        help="every record through the MLP instead of the table of feature combinations")
+    args = parser.parse_args()
+
+    print("Loading model and tools...")
+    server = make_server(
+        Model.load(args.model_dir, lookup=not args.no_lookup), args.host, args.port, args.unix_socket,
+        args.max_batch, args.max_wait_ms / 1000
+    )
+    print(f"Listening on {args.unix_socket or f'{args.host}:{args.port}'}")
+    server.serve_forever()
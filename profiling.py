@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import functools
+import threading
+import tracemalloc
+
+# Per stage instrumentation of the pipeline.
+#
+#   with profiling.stage("process_data.law", rows=len(df)):
+#       ...
+#
+#   @profiling.profiled("process_data")
+#   def process_data(df, ...):
+#
+# Off unless MHMP_PROFILE is set (a trace path, or 1 for profile_trace.jsonl) or enable()
+# is called (python cli.py --profile ...). When off, stage() returns one shared object
+# whose enter / exit do nothing. When on, every finished stage appends one JSON line:
+# wall time, rows, rows/s, the parent stage and with MHMP_PROFILE_MEMORY=1 also the peak
+# memory allocated during the stage (tracemalloc, which makes the code itself slower,
+# and counts the allocations of all threads).
+# Worker processes inherit the environment and append to the same file.
+#
+#   python profiling.py profile_trace.jsonl   # totals per stage
+
+ENV_TRACE = "MHMP_PROFILE"
+ENV_MEMORY = "MHMP_PROFILE_MEMORY"
+DEFAULT_TRACE = "profile_trace.jsonl"
+
+_trace_path = None
+_memory = False
+# the open stages of every thread (the scoring server runs requests in threads,
+# a stage of one request is not the parent of another's)
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def _open_stages():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def enable(path=DEFAULT_TRACE, memory=False):
+    global _trace_path, _memory
+    _trace_path = path
+    _memory = memory
+    # for worker processes started from here
+    os.environ[ENV_TRACE] = path
+    os.environ[ENV_MEMORY] = "1" if memory else "0"
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global _trace_path
+    _trace_path = None
+    os.environ.pop(ENV_TRACE, None)
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def enabled():
+    return _trace_path is not None
+
+
+class _NullStage:
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        # stage.rows = ... inside a with block costs nothing either
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Stage:
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows  # can also be set inside the with block
+        self.peak = 0
+        self.discard = False  # True = leave the stage out of the trace
+
+    def __enter__(self):
+        stack = _open_stages()
+        self.parent = stack[-1].name if stack else None
+        if _memory:
+            # the peak so far belongs to the open stages, then it starts again for this one
+            current, peak = tracemalloc.get_traced_memory()
+            for open_stage in stack:
+                open_stage.peak = max(open_stage.peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = current
+        stack.append(self)
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.start
+        stack = _open_stages()
+        stack.pop()
+        if self.discard:
+            return False
+        record = {
+            "stage": self.name,
+            "parent": self.parent,
+            "start": round(self.start_time, 6),
+            "seconds": seconds,
+            "rows": self.rows,
+            "rows_per_second": self.rows / seconds if self.rows is not None and seconds > 0 else None,
+            "pid": os.getpid(),
+        }
+        if _memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            for open_stage in stack:
+                open_stage.peak = max(open_stage.peak, self.peak)
+            record["peak_alloc_mb"] = (self.peak - self.start_memory) / 2**20
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        with _write_lock, open(_trace_path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+        return False
+
+
+def stage(name, rows=None):
+    return Stage(name, rows) if _trace_path is not None else _NULL_STAGE
+
+
+def profiled(name):
+    # decorator, the whole call is a stage with the length of the first argument as rows
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _trace_path is None:
+                return func(*args, **kwargs)
+            rows = len(args[0]) if args and hasattr(args[0], "__len__") else None
+            with Stage(name, rows):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def iter_stage(name, iterable):
+    # the iterable with the time spent producing every item recorded as a stage
+    # (chunks read from disk, for example)
+    if _trace_path is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        with stage(name) as current:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                current.discard = True
+                return
+            current.rows = len(item) if hasattr(item, "__len__") else None
+        yield item
+
+
+def read_trace(path=DEFAULT_TRACE):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def summarize(records):
+    # stage -> calls, seconds, rows, rows/s and the largest peak over all its records
+    import pandas as pd
+
+    df = pd.DataFrame(records)
+    if "peak_alloc_mb" not in df:
+        df["peak_alloc_mb"] = float("nan")
+    summary = df.groupby("stage", sort=False).agg(
+        calls=("seconds", "size"), seconds=("seconds", "sum"),
+        rows=("rows", lambda rows: rows.sum(min_count=1)), peak_alloc_mb=("peak_alloc_mb", "max"),
+    )
+    summary["rows_per_second"] = summary["rows"] / summary["seconds"]
+    return summary.sort_values("seconds", ascending=False)
+
+
+def _configure_from_environment():
+    path = os.environ.get(ENV_TRACE)
+    if path and path != "0":
+        enable(DEFAULT_TRACE if path == "1" else path, os.environ.get(ENV_MEMORY, "0") not in ("", "0"))
+
+
+_configure_from_environment()
+
+
+if __name__ == "__main__":
+    print(summarize(read_trace(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TRACE)).to_string())
@@ -0,0 +1,91 @@
+import io
+import importlib.util
+
+import numpy as np
+import pandas as pd
+
+# Loader of the raw MHMP exports (MHMP_dopravni_prestupky_20xx.csv).
+# Only the columns the pipeline reads are parsed, the repetitive text columns come
+# straight as categoricals (every distinct string stored once, the features are then
+# computed per category), and the header is checked before anything is read,
+# so a wrong file fails at once with the missing columns instead of a KeyError deep
+# in process_data. Everything is read with the C engine by default, like the chunked reads.
+# engine="auto" reads whole files with pyarrow's multithreaded reader when it is installed
+# (the C engine otherwise); its NA handling and categoricals have to match the chunked
+# path, which `python data_process.py <file>` checks for both engines.
+#
+#   df = read_raw("MHMP_dopravni_prestupky_2023.csv")
+#   for chunk in read_raw(path, chunksize=500_000): ...
+
+# what process_data reads; OZNAM (the label) is missing in data to be classified
+RAW_COLUMNS = ["DATSK", "CASSK", "PRAHA", "MISTOSK", "TOVZN", "PRAVFOR", "MPZ", "FIRMA", "OZNAM"]
+OPTIONAL_COLUMNS = ["OZNAM"]
+
+# few distinct values against millions of rows
+CATEGORY_COLUMNS = ["OZNAM", "FIRMA", "MPZ", "PRAHA", "MISTOSK", "TOVZN", "PRAVFOR", "DATSK", "CASSK"]
+
+
+def read_header(path):
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def check_raw_columns(path, columns=RAW_COLUMNS, optional=OPTIONAL_COLUMNS):
+    # the requested columns the file has, ValueError if a required one is missing
+    header = read_header(path)
+    missing = [column for column in columns if column not in header and column not in optional]
+    if missing:
+        raise ValueError(f"{path} is not an MHMP export, missing columns: {', '.join(missing)} "
+                         f"(the file has {', '.join(header)})")
+    return [column for column in columns if column in header]
+
+
+def raw_dtypes(columns, categories=CATEGORY_COLUMNS):
+    return {column: "category" for column in columns if column in categories}
+
+
+def read_raw(path, columns=RAW_COLUMNS, categories=CATEGORY_COLUMNS, chunksize=None, engine=None):
+    # the whole file as one frame, or with chunksize an iterator of frames
+    usecols = check_raw_columns(path, columns)
+    options = {"usecols": usecols, "dtype": raw_dtypes(usecols, categories)}
+    if chunksize is not None:
+        return pd.read_csv(path, chunksize=chunksize, **options)
+    if engine == "auto":
+        engine = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+    return pd.read_csv(path, engine=engine or "c", **options)
+
+
+def row_offsets(path, step, block_size=1 << 24):
+    # (byte offsets where the rows 0, step, 2 * step, ... start, number of rows), row 0 = the
+    # first line after the header, found by scanning the bytes for line breaks block by block.
+    # Rows are lines: no line breaks inside quoted values, and blank lines count as rows
+    # (their shard reads them and pandas skips them, like a whole-file read does)
+    offsets = []
+    lines = 0  # line breaks before the block
+    position = 0  # bytes before the block
+    last = b""
+    with open(path, "rb") as file:
+        while True:
+            block = file.read(block_size)
+            if not block:
+                break
+            breaks = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord("\n"))
+            # row r starts after line break number r (the one ending the header is number 0)
+            numbers = lines + np.arange(len(breaks))
+            offsets.extend((position + breaks[numbers % step == 0] + 1).tolist())
+            lines += len(breaks)
+            position += len(block)
+            last = block[-1:]
+    # a line break at the very end starts no row
+    rows = max(0, lines - 1 if last == b"\n" else lines)
+    return [offset for offset in offsets if offset < position], rows
+
+
+def read_raw_rows(path, header, start, end=None, columns=RAW_COLUMNS, categories=CATEGORY_COLUMNS):
+    # the rows between byte offsets start and end (row starts, see row_offsets; None = to the end
+    # of the file), header = the file's columns. Only that range is read, the rows before it
+    # are not parsed again
+    usecols = [column for column in columns if column in header]
+    with open(path, "rb") as file:
+        file.seek(start)
+        data = io.BytesIO(file.read() if end is None else file.read(end - start))
+    return pd.read_csv(data, header=None, names=header, usecols=usecols, dtype=raw_dtypes(usecols, categories))
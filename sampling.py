@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+
+# Class balancing by downsampling, in one pass over the data chunk by chunk.
+# Every row gets a pseudo random priority from a hash of its key (row position in the
+# file, plus a per-file salt) and the seed, so the sample does not depend on the chunk
+# size, the order of the chunks or the number of workers, only on the seed.
+#
+# exact: StratifiedSampler keeps per class the target_c rows with the smallest
+#   priorities (a bottom-k reservoir), memory is bounded by the size of the sample
+# hash: keep_mask keeps a row when its priority falls under the class' keep rate,
+#   nothing is held in memory and the class sizes hit the targets up to a few sqrt(n)
+#
+# Both need the class counts for the targets, count_labels gets them from the label
+# column alone (a cheap extra read).
+#
+#   counts = count_labels("MHMP_dopravni_prestupky_2023.csv")
+#   sampler = StratifiedSampler(balanced_targets(counts), seed=42)
+#   for df_clean in iter_processed_chunks(path):
+#       sampler.update(df_clean)
+#   df_balanced = sampler.result()
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(h):
+    # splitmix64 finalizer on uint64 arrays
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xBF58476D1CE4E5B9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def row_priorities(keys, seed=0, salt=0):
+    # uint64 priority of every row key, uniform and fixed for (key, seed, salt)
+    with np.errstate(over="ignore"):
+        base = _mix(np.array([seed], dtype=np.uint64) * _GOLDEN + np.uint64(salt))
+        return _mix(np.asarray(keys).astype(np.uint64) * _GOLDEN + base)
+
+
+def count_labels(paths, label_column="OZNAM", chunksize=500_000):
+    # class counts of raw MHMP csv files (one path or a list), only the label column is read
+    counts = pd.Series(dtype=np.int64)
+    for path in [paths] if isinstance(paths, str) else paths:
+        for chunk in pd.read_csv(path, usecols=[label_column], dtype="category", chunksize=chunksize):
+            counts = counts.add(chunk[label_column].value_counts(), fill_value=0)
+    return counts.astype(np.int64)
+
+
+def balanced_targets(counts, ratio=1.0, classes=None):
+    # rows to keep per class: the smallest class whole, the others at most ratio times
+    # its size (ratio 1.0 = 1:1); classes limits the sample to those labels
+    counts = pd.Series(counts)
+    if classes is not None:
+        counts = counts[counts.index.isin(classes)]
+    counts = counts[counts > 0]
+    if counts.empty:
+        return {}
+    minority = int(counts.min())
+    return {label: min(int(count), int(minority * ratio)) if count > minority else int(count)
+            for label, count in counts.items()}
+
+
+def keep_mask(labels, keys, targets, counts, seed=0, salt=0):
+    # hash based sampling: True for the rows to keep, rate target / count per class,
+    # labels not in targets are dropped
+    labels = np.asarray(labels, dtype=object)
+    rates = np.zeros(len(labels))
+    for label, target in targets.items():
+        rates[labels == label] = target / counts[label] if counts[label] else 0.0
+    # the top 53 bits of the priority as a uniform number in [0, 1)
+    uniform = (row_priorities(keys, seed, salt) >> np.uint64(11)).astype(np.float64) / 2.0**53
+    return uniform < rates
+
+
+class StratifiedSampler:
+
+    def __init__(self, targets, label_column="OZNAM", seed=0):
+        self.targets = dict(targets)
+        self.label_column = label_column
+        self.seed = seed
+        # label -> list of (priorities, positions in the chunk, chunk number, rows) candidates,
+        # compacted to the target
+        self.candidates = {label: [] for label in self.targets}
+        self.sizes = {label: 0 for label in self.targets}
+        self.chunks = 0
+        # no rows of the first chunk, what result() gives when nothing was sampled
+        self.empty = pd.DataFrame(columns=[label_column])
+
+    def update(self, df, keys=None, salt=0):
+        # keys: row keys (unique over all the data, default the index);
+        # salt: tells apart files whose keys repeat (row positions)
+        keys = np.asarray(df.index if keys is None else keys)
+        labels = np.asarray(df[self.label_column], dtype=object)
+        priorities = row_priorities(keys, self.seed, salt)
+        if not self.chunks:
+            self.empty = df.iloc[:0]
+        self.chunks += 1
+        for label, target in self.targets.items():
+            rows = np.flatnonzero(labels == label)
+            if not len(rows) or not target:
+                continue
+            if len(rows) > target:
+                # more than the target can never be needed from one chunk
+                rows = rows[np.argpartition(priorities[rows], target - 1)[:target]]
+            rows.sort()
+            self.candidates[label].append((priorities[rows], rows, self.chunks, df.iloc[rows]))
+            self.sizes[label] += len(rows)
+            if self.sizes[label] > 2 * target:
+                self._compact(label)
+
+    def _compact(self, label):
+        target = self.targets[label]
+        parts = self.candidates[label]
+        priorities = np.concatenate([part[0] for part in parts])
+        keep = np.zeros(len(priorities), dtype=bool)
+        keep[np.argpartition(priorities, target - 1)[:target]] = True
+        compacted, start = [], 0
+        for part_priorities, positions, chunk, rows in parts:
+            part_keep = keep[start:start + len(part_priorities)]
+            start += len(part_priorities)
+            if part_keep.any():
+                compacted.append((part_priorities[part_keep], positions[part_keep], chunk, rows[part_keep]))
+        self.candidates[label] = compacted
+        self.sizes[label] = sum(len(part[0]) for part in compacted)
+
+    def result(self):
+        # the sample in the original order (chunk, then row within it); with nothing sampled
+        # (no rows of the target classes, or no chunks) an empty frame with the input's
+        # columns and dtypes
+        for label in self.targets:
+            if self.sizes[label] > self.targets[label]:
+                self._compact(label)
+        parts = [part for label in self.targets for part in self.candidates[label]]
+        if not parts:
+            return self.empty
+        df = pd.concat([part[3] for part in parts])
+        chunks = np.concatenate([np.full(len(part[0]), part[2]) for part in parts])
+        positions = np.concatenate([part[1] for part in parts])
+        return df.iloc[np.lexsort((positions, chunks))]
+
+
+def sample_chunks(chunks, counts, label_column="OZNAM", ratio=1.0, classes=None, seed=0):
+    # exact balanced sample of a stream of frames indexed by unique row keys
+    # (iter_processed_chunks), only the sample is kept in memory
+    sampler = StratifiedSampler(balanced_targets(counts, ratio, classes), label_column, seed)
+    for df in chunks:
+        sampler.update(df)
+    return sampler.result()
+
+
+def sample_frame(df, label_column="OZNAM", ratio=1.0, classes=None, seed=0, keys=None):
+    # exact balanced sample of a frame in memory (keys default to the row positions)
+    targets = balanced_targets(df[label_column].value_counts(), ratio, classes)
+    sampler = StratifiedSampler(targets, label_column, seed)
+    sampler.update(df, np.arange(len(df)) if keys is None else keys)
+    return sampler.result()
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.neural_network import MLPClassifier
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler, LabelEncoder
+
+from encoder import FeatureEncoder
+from inference import save_bundle, BUNDLE_DIR
+
+# Hyperparameter sweep of the MLP, every configuration in its own worker process.
+# The scaled train / test matrices are written once as .npy files and every worker
+# opens them with mmap_mode="r", so the processes share the pages instead of
+# each getting a pickled copy. Each worker uses one BLAS thread, the sweep takes
+# about as long as the slowest configuration when there are enough cores.
+#
+#   python sweep.py MHMP_dopravni_prestupky_2023.csv --layers 50,25 100,50 100 --alpha 1e-4 1e-3
+
+DEFAULT_GRID = {
+    "hidden_layer_sizes": [(50, 25), (100, 50), (100,)],
+    "alpha": [1e-4, 1e-3],
+    "learning_rate_init": [1e-3],
+    "batch_size": [200],
+}
+
+_worker_data = None
+
+
+def prepare_design_matrix(df_clean, directory, test_size=0.2, random_state=123):
+    # the same split and scaling as train.py, written as .npy files for the workers
+    X_raw = df_clean.drop(columns=["OZNAM"])
+    le = LabelEncoder()
+    y = le.fit_transform(df_clean["OZNAM"])
+    encoder = FeatureEncoder.fit(X_raw, drop_first=True)
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        encoder.transform(X_raw), y, test_size=test_size, stratify=y, random_state=random_state
+    )
+    scaler = StandardScaler()
+    arrays = {
+        "X_train": scaler.fit_transform(X_train.toarray()),
+        "X_test": scaler.transform(X_test.toarray()),
+        "y_train": y_train,
+        "y_test": y_test,
+    }
+    os.makedirs(directory, exist_ok=True)
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, name + ".npy"), np.ascontiguousarray(values))
+    return encoder, scaler, le
+
+
+def _init_worker(directory):
+    global _worker_data
+    from threadpoolctl import threadpool_limits
+    # one BLAS thread per worker, the parallelism is across configurations
+    threadpool_limits(1)
+    _worker_data = {
+        name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+        for name in ("X_train", "X_test", "y_train", "y_test")
+    }
+
+
+def _train_config(config, max_iter, random_state):
+    data = _worker_data
+    start = time.perf_counter()
+    mlp = MLPClassifier(**config, max_iter=max_iter, random_state=random_state)
+    mlp.fit(data["X_train"], data["y_train"])
+    fit_seconds = time.perf_counter() - start
+    result = {
+        **config,
+        "test_score": mlp.score(data["X_test"], data["y_test"]),
+        "train_score": mlp.score(data["X_train"], data["y_train"]),
+        "n_iter": mlp.n_iter_,
+        "fit_seconds": fit_seconds,
+    }
+    return result, mlp
+
+
+def make_grid(grid):
+    # cartesian product of the parameter lists as a list of MLPClassifier kwargs
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def run_sweep(df_clean, grid=DEFAULT_GRID, directory="sweep", workers=None, max_iter=50, random_state=42):
+    encoder, scaler, le = prepare_design_matrix(df_clean, directory)
+    configs = make_grid(grid)
+    workers = workers or min(len(configs), os.cpu_count())
+
+    results = []
+    models = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(directory,)) as pool:
+        futures = [pool.submit(_train_config, config, max_iter, random_state) for config in configs]
+        for future in as_completed(futures):
+            result, mlp = future.result()
+            print(f"{result['hidden_layer_sizes']} alpha={result['alpha']} lr={result['learning_rate_init']} "
+                  f"batch={result['batch_size']}: {result['test_score']:.4f} ({result['fit_seconds']:.1f} s)")
+            results.append(result)
+            models.append(mlp)
+    print(f"{len(configs)} configurations in {time.perf_counter() - start:.1f} s, "
+          f"the slowest took {max(result['fit_seconds'] for result in results):.1f} s")
+
+    leaderboard = pd.DataFrame(results)
+    leaderboard["hidden_layer_sizes"] = leaderboard["hidden_layer_sizes"].map(
+        lambda sizes: ",".join(str(size) for size in sizes)
+    )
+    order = leaderboard.sort_values(["test_score", "fit_seconds"], ascending=[False, True]).index
+    leaderboard = leaderboard.loc[order].reset_index(drop=True)
+    leaderboard.to_csv(os.path.join(directory, "leaderboard.csv"), index=False)
+
+    # the best model as a bundle (+ its pickles) next to the leaderboard
+    best = {"mlp": models[order[0]], "scaler": scaler, "model_columns": encoder.columns, "le": le, "encoder": encoder}
+    save_bundle(os.path.join(directory, BUNDLE_DIR), **best)
+    joblib.dump(best, os.path.join(directory, "best_model.pkl"))
+    with open(os.path.join(directory, "best_config.json"), "w") as file:
+        json.dump(leaderboard.iloc[0].to_dict(), file, indent=1, default=str)
+    return leaderboard, best
+
+
+def parse_layers(text):
+    # "50,25" -> (50, 25)
+    return tuple(int(size) for size in text.split(","))
+
+
+def add_arguments(parser):
+    parser.add_argument("data", nargs="?", default="MHMP_dopravni_prestupky_2023.csv",
+                        help="raw MHMP csv or cleaned .npz")
+    parser.add_argument("--layers", nargs="+", type=parse_layers, default=DEFAULT_GRID["hidden_layer_sizes"],
+                        help="hidden layer sizes, e.g. 50,25 100")
+    parser.add_argument("--alpha", nargs="+", type=float, default=DEFAULT_GRID["alpha"])
+    parser.add_argument("--learning-rate", nargs="+", type=float, default=DEFAULT_GRID["learning_rate_init"])
+    parser.add_argument("--batch-size", nargs="+", type=int, default=DEFAULT_GRID["batch_size"])
+    parser.add_argument("--max-iter", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="sweep", help="directory for the matrices, leaderboard and best model")
+    parser.add_argument("--cache", default="feature_cache.pkl")
+    parser.add_argument("--export", action="store_true", help="also export the best model as the model of predict.py")
+
+
+def run(args):
+    from train import load_training_data, export_model
+
+    df_clean = load_training_data(args.data, args.cache)
+    grid = {
+        "hidden_layer_sizes": args.layers,
+        "alpha": args.alpha,
+        "learning_rate_init": args.learning_rate,
+        "batch_size": args.batch_size,
+    }
+    leaderboard, best = run_sweep(df_clean, grid, args.out, args.workers, args.max_iter)
+    print(leaderboard.to_string())
+    if args.export:
+        export_model(**best)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="parallel hyperparameter sweep of the MLP")
+    add_arguments(parser)
+    run(parser.parse_args())
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+# Parser of the MHMP date and time columns for the formats that occur in the exports:
+# DATSK "YYYY-MM-DD", CASSK "HH:MM:SS", "HH:MM" or missing.
+# Only the distinct values are parsed (a year has 365 dates and at most 86400 times
+# against millions of rows) and the result is spread back by the factorize codes.
+# The fields are read from fixed character positions of the strings as a NumPy array of
+# code points; values of any other shape, or out of range (25:00, 2023-02-30), go to
+# pd.to_datetime like before, so the results are the same as
+#
+#   pd.to_datetime(datsk)
+#   pd.to_datetime(cassk, format="mixed", errors="coerce").dt.hour.fillna(-1)
+#
+# only faster. A missing or unreadable time has hour -1.
+
+_ZERO = ord("0")
+
+
+def _factorize(series):
+    # codes per row (-1 = missing) and the distinct values as an object array
+    codes, uniques = pd.factorize(series)
+    return codes, np.asarray(uniques, dtype=object)
+
+
+def _code_points(values, width):
+    # values whose length is width -> (n, width) array of their characters' code points,
+    # plus the mask of which values those were
+    is_width = np.array([isinstance(value, str) and len(value) == width for value in values], dtype=bool)
+    points = np.array(values[is_width].tolist() or [""], dtype=f"U{width}").view(np.uint32)
+    return points.reshape(-1, width)[:is_width.sum()], is_width
+
+
+def _number(points, positions):
+    # the digits at positions as one number, -1 where one of them is not a digit
+    digits = points[:, positions].astype(np.int64) - _ZERO
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    number = np.zeros(len(points), dtype=np.int64)
+    for column in range(len(positions)):
+        number = number * 10 + digits[:, column]
+    return np.where(valid, number, -1)
+
+
+def parse_clock_values(values):
+    # hour, minute, second of "HH:MM:SS" / "HH:MM" values, -1 for anything else
+    n = len(values)
+    hour = np.full(n, -1, dtype=np.int64)
+    minute = np.full(n, -1, dtype=np.int64)
+    second = np.full(n, -1, dtype=np.int64)
+    for width in (8, 5):
+        points, mask = _code_points(values, width)
+        h = _number(points, [0, 1])
+        m = _number(points, [3, 4])
+        s = _number(points, [6, 7]) if width == 8 else np.zeros(len(points), dtype=np.int64)
+        separators = points[:, 2] == ord(":")
+        if width == 8:
+            separators &= points[:, 5] == ord(":")
+        valid = separators & (h >= 0) & (h < 24) & (m >= 0) & (m < 60) & (s >= 0) & (s < 60)
+        index = np.flatnonzero(mask)[valid]
+        hour[index], minute[index], second[index] = h[valid], m[valid], s[valid]
+    return hour, minute, second
+
+
+def parse_date_values(values):
+    # "YYYY-MM-DD" values as datetime64[D], NaT for anything else
+    days = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[D]")
+    points, mask = _code_points(values, 10)
+    year = _number(points, [0, 1, 2, 3])
+    month = _number(points, [5, 6])
+    day = _number(points, [8, 9])
+    valid = (points[:, 4] == ord("-")) & (points[:, 7] == ord("-")) & (year >= 0) & (month >= 1) & (month <= 12)
+    first = (np.where(valid, year, 1970) - 1970) * 12 + np.where(valid, month, 1) - 1
+    first = first.astype("datetime64[M]")
+    month_length = ((first + 1).astype("datetime64[D]") - first.astype("datetime64[D]")).astype(np.int64)
+    valid &= (day >= 1) & (day <= month_length)
+    days[np.flatnonzero(mask)[valid]] = first[valid].astype("datetime64[D]") + (day[valid] - 1)
+    return days
+
+
+def parse_hours(cassk):
+    # hour per row (int64), -1 where the time is missing or unreadable
+    codes, uniques = _factorize(cassk)
+    hour, _, _ = parse_clock_values(uniques)
+    unknown = np.flatnonzero(hour < 0)
+    if len(unknown):
+        # other spellings (7:05, 14:30:00.000, ...) the way the pipeline parsed them before
+        parsed = pd.to_datetime(pd.Series(uniques[unknown]), format="mixed", errors="coerce")
+        hour[unknown] = parsed.dt.hour.fillna(-1).to_numpy(dtype=np.int64)
+    return np.append(hour, -1)[codes]
+
+
+def parse_dates(datsk):
+    # datetime64[D] per row, NaT where the date is missing.
+    # Values that are not YYYY-MM-DD go to pd.to_datetime, which raises on nonsense as before
+    # (each in its own format, the leftovers do not share one)
+    codes, uniques = _factorize(datsk)
+    days = parse_date_values(uniques)
+    unknown = np.flatnonzero(np.isnat(days))
+    if len(unknown):
+        parsed = pd.to_datetime(pd.Series(uniques[unknown]), format="mixed")
+        days[unknown] = parsed.to_numpy().astype("datetime64[D]")
+    return np.append(days, np.datetime64("NaT"))[codes]
+
+
+def parse_timestamps(datsk, cassk):
+    # date + time as datetime64[s] like main.py's
+    # pd.to_datetime(DATSK + " " + CASSK, format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    # with a missing time as 00:00:00 and HH:MM as HH:MM:00; NaT where it cannot be read
+    date_codes, date_uniques = _factorize(datsk)
+    days = parse_date_values(date_uniques)
+    unknown = np.flatnonzero(np.isnat(days))
+    if len(unknown):
+        parsed = pd.to_datetime(pd.Series(date_uniques[unknown]), format="%Y-%m-%d", errors="coerce")
+        days[unknown] = parsed.to_numpy().astype("datetime64[D]")
+
+    time_codes, time_uniques = _factorize(cassk)
+    hour, minute, second = parse_clock_values(time_uniques)
+    seconds = hour * 3600 + minute * 60 + second
+    unknown = np.flatnonzero(hour < 0)
+    if len(unknown):
+        padded = pd.Series(time_uniques[unknown]).map(lambda t: t + ":00" if isinstance(t, str) and len(t) == 5 else t)
+        parsed = pd.to_datetime(padded, format="%H:%M:%S", errors="coerce")
+        seconds[unknown] = (parsed.dt.hour * 3600 + parsed.dt.minute * 60 + parsed.dt.second).fillna(-1).to_numpy(dtype=np.int64)
+
+    days = np.append(days, np.datetime64("NaT"))[date_codes]
+    seconds = np.append(seconds, 0)[time_codes]
+    timestamps = days.astype("datetime64[s]") + np.maximum(seconds, 0).astype("timedelta64[s]")
+    return np.where(seconds < 0, np.datetime64("NaT"), timestamps)
+
+
+def month_numbers(days):
+    # 1..12, 0 where the date is NaT
+    months = days.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    return np.where(np.isnat(days), 0, months)
+
+
+def years(days):
+    return np.where(np.isnat(days), 0, days.astype("datetime64[Y]").astype(np.int64) + 1970)
+
+
+def weekdays(days):
+    # 0 = Monday like pandas' .dt.weekday (1970-01-01 was a Thursday), -1 where NaT
+    return np.where(np.isnat(days), -1, (days.astype(np.int64) + 3) % 7)
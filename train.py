@@ -1,68 +1,329 @@
+import os
+import copy
+import time
+import inspect
+import zlib
+import tempfile
+import numpy as np
 import pandas as pd
 import joblib
-import seaborn as sns
-import matplotlib.pyplot as plt
 from sklearn.neural_network import MLPClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.metrics import classification_report, confusion_matrix
-from data_process import process_data
-
-# 1. load data and process them
-print("loading data...")
-raw_df = pd.read_csv("MHMP_dopravni_prestupky_2023.csv")
-
-print("clearing data...")
-df_clean = process_data(raw_df)
-
-"""df_clean = pd.read_csv("2023_clean.csv")"""
-
-# 2. prepare X and y
-X_raw = df_clean.drop(columns=["OZNAM"])
-y_raw = df_clean["OZNAM"]
-
-# Encoder for target (PČR/MPP -> 1/0)
-le = LabelEncoder()
-y = le.fit_transform(y_raw)
-
-# One-Hot Encoding for inputs
-X_encoded = pd.get_dummies(X_raw, drop_first=True)
-
-# 3. save names od columns
-model_columns = list(X_encoded.columns)
-
-# 4. Split and Scale
-X_train, X_test, y_train, y_test = train_test_split(X_encoded, y, test_size=0.2, stratify=y, random_state=123)
-scaler = StandardScaler()
-X_train_scaled = scaler.fit_transform(X_train)
-
-# 5. Training
-print("training MLP...")
-mlp = MLPClassifier(hidden_layer_sizes=(50, 25), max_iter=50, random_state=42)
-mlp.fit(X_train_scaled, y_train)
-print(f"training completed. test score: {mlp.score(scaler.transform(X_test), y_test):.4f}")
-
-
-# 6. Export
-print("saving model...")
-joblib.dump(mlp, 'model_mlp.pkl')
-joblib.dump(scaler, 'model_scaler.pkl')
-joblib.dump(model_columns, 'model_columns.pkl')
-joblib.dump(le, 'model_le.pkl')
-print("DONE.")
-
-# Predikce na testovacích datech
-y_pred = mlp.predict(scaler.transform(X_test))
-
-# Výpis reportu
-print("detail report:")
-print(classification_report(y_test, y_pred, target_names=le.classes_))
-
-# Vizuální matice záměn
-cm = confusion_matrix(y_test, y_pred)
-sns.heatmap(cm, annot=True, fmt='d', cmap='Blues',
-            xticklabels=le.classes_, yticklabels=le.classes_)
-plt.xlabel('model prediction')
-plt.ylabel('reality')
-plt.title('confusion matrix')
-plt.show()
\ No newline at end of file
+from data_process import iter_processed_chunks, FeatureCache, FEATURE_COLUMNS
+from clean_store import save_clean, load_clean
+from encoder import FeatureEncoder
+from inference import save_bundle, BUNDLE_DIR, PredictionTable
+from sampling import sample_frame, sample_chunks, count_labels, balanced_targets, keep_mask
+import profiling
+
+
+def load_training_data(path="MHMP_dopravni_prestupky_2023.csv", cache_path="feature_cache.pkl",
+                       balance=None, seed=42):
+    # raw MHMP csv (read in chunks, only the cleaned columns are kept in memory)
+    # or an already cleaned .npz;
+    # balance: downsample the classes to at most balance : 1 (see sampling.py), None = as they are
+    if path.endswith(".npz"):
+        df_clean = load_clean(path)
+        return df_clean if balance is None else sample_frame(df_clean, ratio=balance, seed=seed)
+    # parsed PRAVFOR/TOVZN/MISTOSK/PRAHA values are reused between runs
+    feature_cache = FeatureCache(cache_path) if cache_path else None
+    chunks = iter_processed_chunks(path, cache=feature_cache)
+    if balance is None:
+        df_clean = pd.concat(chunks)
+    else:
+        # only the sample is kept, not the whole file
+        df_clean = sample_chunks(chunks, count_labels(path), ratio=balance, seed=seed)
+    if feature_cache is not None:
+        feature_cache.save()
+    return df_clean
+
+
+def collapse_duplicates(X_raw, y, encoder):
+    # identical training rows (the same encoded features and label) -> the positions of
+    # the first of each, in order, and how many there are. The features are all categorical,
+    # so most rows repeat; the key is the PredictionTable one (rows with the same key have
+    # the same one-hot row), rows without a key are kept as they are
+    keys = PredictionTable(encoder).frame_keys(X_raw)
+    codes, _ = pd.factorize(keys)
+    combined = np.where(keys >= 0, codes * (int(y.max(initial=0)) + 1) + y, -1 - np.arange(len(keys)))
+    inverse, distinct = pd.factorize(combined)
+    first = np.empty(len(distinct), dtype=np.intp)
+    first[inverse[::-1]] = np.arange(len(keys) - 1, -1, -1)
+    return first, np.bincount(inverse, minlength=len(distinct)).astype(np.float64)
+
+
+def fit_weighted(mlp, X, y, weights, random_state=42):
+    # MLP on unique rows with their counts, as sample_weight where the estimator takes it
+    if "sample_weight" in inspect.signature(mlp.fit).parameters:
+        return mlp.fit(X, y, sample_weight=weights)
+    return fit_weighted_minibatches(mlp, X, y, weights, random_state)
+
+
+def fit_weighted_minibatches(mlp, X, y, weights, random_state=42):
+    # for estimators without sample_weight: partial_fit on minibatches drawn with probability
+    # proportional to the counts, max_iter epochs of len(y) draws each
+    rng = np.random.default_rng(random_state)
+    batch_size = min(200, len(y)) if mlp.batch_size == "auto" else mlp.batch_size
+    classes = np.unique(y)
+    for _ in range(mlp.max_iter):
+        rows = rng.choice(len(y), size=len(y), p=weights / weights.sum())
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            mlp.partial_fit(X[batch], y[batch], classes=classes)
+    return mlp
+
+
+def train_model(df_clean, dedup=False):
+    # dedup: train on the unique rows weighted by their counts (collapse_duplicates),
+    # the test part stays all the rows
+    # 2. prepare X and y
+    X_raw = df_clean.drop(columns=["OZNAM"])
+    y_raw = df_clean["OZNAM"]
+
+    # Encoder for target (PČR/MPP -> 1/0)
+    le = LabelEncoder()
+    y = le.fit_transform(y_raw)
+
+    # One-Hot Encoding for inputs
+    # fitted encoder with the same columns as pd.get_dummies(X_raw, drop_first=True), gives a sparse matrix
+    with profiling.stage("train.encode", len(X_raw)):
+        encoder = FeatureEncoder.fit(X_raw, drop_first=True)
+        X_encoded = encoder.transform(X_raw)
+
+    # 3. save names od columns
+    model_columns = encoder.columns
+
+    # 4. Split and Scale
+    # (centering makes the matrix dense anyway, so the split parts are densified here)
+    train_rows, test_rows = train_test_split(np.arange(len(y)), test_size=0.2, stratify=y, random_state=123)
+    weights = None
+    if dedup:
+        with profiling.stage("train.dedup", len(train_rows)):
+            unique, weights = collapse_duplicates(X_raw.iloc[train_rows], y[train_rows], encoder)
+            print(f"{len(train_rows)} training rows, {len(unique)} unique")
+            train_rows = train_rows[unique]
+    y_train, y_test = y[train_rows], y[test_rows]
+    with profiling.stage("train.scale", len(train_rows)):
+        X_train, X_test = X_encoded[train_rows].toarray(), X_encoded[test_rows].toarray()
+        scaler = StandardScaler()
+        X_train_scaled = scaler.fit_transform(X_train, sample_weight=weights)
+
+    # 5. Training
+    print("training MLP...")
+    mlp = MLPClassifier(hidden_layer_sizes=(50, 25), max_iter=50, random_state=42)
+    with profiling.stage("train.fit", len(y_train)):
+        if weights is None:
+            mlp.fit(X_train_scaled, y_train)
+        else:
+            fit_weighted(mlp, X_train_scaled, y_train, weights)
+    print(f"training completed. test score: {mlp.score(scaler.transform(X_test), y_test):.4f}")
+
+    artifacts = {"mlp": mlp, "scaler": scaler, "model_columns": model_columns, "le": le, "encoder": encoder}
+    return artifacts, X_test, y_test
+
+
+def compare_with_full(df_clean):
+    # parity check of the deduplicated, weighted training against training on all the rows:
+    # (test score, seconds) of both, on the same test rows
+    results = {}
+    for dedup in (False, True):
+        start = time.perf_counter()
+        artifacts, X_test, y_test = train_model(df_clean, dedup)
+        seconds = time.perf_counter() - start
+        results["dedup" if dedup else "full"] = (artifacts["mlp"].score(artifacts["scaler"].transform(X_test), y_test), seconds)
+    return results
+
+
+@profiling.profiled("train.export")
+def export_model(mlp, scaler, model_columns, le, encoder, observed=None):
+    print("saving model...")
+    joblib.dump(mlp, 'model_mlp.pkl')
+    joblib.dump(scaler, 'model_scaler.pkl')
+    joblib.dump(model_columns, 'model_columns.pkl')
+    joblib.dump(encoder, 'model_encoder.pkl')
+    joblib.dump(le, 'model_le.pkl')
+    # the bundle predict.py and predict_server.py load (memory mapped weights + manifest),
+    # the pickles above stay for working with the sklearn objects;
+    # with the outputs of the feature combinations of observed (the training data) precomputed
+    save_bundle(BUNDLE_DIR, mlp, scaler, model_columns, le, encoder, observed)
+    print("DONE.")
+
+
+@profiling.profiled("train.report")
+def show_report(mlp, scaler, le, X_test, y_test, show_plot=True):
+    # sklearn.metrics and the plotting libraries are only imported here
+    from sklearn.metrics import classification_report, confusion_matrix
+
+    # Predikce na testovacích datech
+    y_pred = mlp.predict(scaler.transform(X_test))
+
+    # Výpis reportu
+    print("detail report:")
+    print(classification_report(y_test, y_pred, target_names=le.classes_))
+
+    if not show_plot:
+        return
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
+    # Vizuální matice záměn
+    cm = confusion_matrix(y_test, y_pred)
+    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues',
+                xticklabels=le.classes_, yticklabels=le.classes_)
+    plt.xlabel('model prediction')
+    plt.ylabel('reality')
+    plt.title('confusion matrix')
+    plt.show()
+
+
+# --- incremental training (all years, out of core) ---
+# Pass 1 cleans every file chunk by chunk and spills the cleaned chunks to .npz files
+# (train and validation rows apart), collecting the categories and classes on the way.
+# The scaler is then fitted with partial_fit and the MLP trained with partial_fit
+# for a few epochs over the spilled chunks, so only one chunk is ever in memory.
+
+def validation_mask(index, salt, fraction=0.2):
+    # held-out rows picked by a hash of the row position and the file,
+    # the same rows every run whatever the chunk size
+    h = (np.asarray(index, dtype=np.uint64) + np.uint64(salt)) * np.uint64(0x9E3779B97F4A7C15)
+    h ^= h >> np.uint64(31)
+    return h % np.uint64(10_000) < int(fraction * 10_000)
+
+
+def spill_chunks(paths, spill_dir, chunksize=500_000, cache=None, validation_fraction=0.2,
+                 balance=None, seed=42):
+    # balance: downsample the classes to at most balance : 1 over all the files
+    # (hash sampling, the chunks are spilled as they come)
+    train_files, validation_files = [], []
+    categories = {}
+    numeric = []
+    labels = set()
+    if balance is not None:
+        counts = count_labels(paths, chunksize=chunksize)
+        targets = balanced_targets(counts, balance)
+    for path in paths:
+        salt = zlib.crc32(os.path.basename(path).encode("utf-8"))
+        for df_clean in iter_processed_chunks(path, chunksize, cache):
+            if balance is not None:
+                df_clean = df_clean[keep_mask(df_clean["OZNAM"], df_clean.index, targets, counts, seed, salt)]
+            for feature in FEATURE_COLUMNS:
+                if pd.api.types.is_numeric_dtype(df_clean[feature]):
+                    if feature not in numeric:
+                        numeric.append(feature)
+                else:
+                    categories.setdefault(feature, set()).update(df_clean[feature].dropna().unique())
+            labels.update(df_clean["OZNAM"].dropna().unique())
+
+            held_out = validation_mask(df_clean.index, salt, validation_fraction)
+            for part, files in ((df_clean[~held_out], train_files), (df_clean[held_out], validation_files)):
+                if len(part):
+                    files.append(os.path.join(spill_dir, f"chunk_{len(train_files) + len(validation_files)}.npz"))
+                    save_clean(part, files[-1])
+    return train_files, validation_files, categories, numeric, sorted(labels)
+
+
+def fit_encoder(categories, numeric, drop_first=True):
+    # the encoder of the collected categories, the same columns as FeatureEncoder.fit
+    # (pd.get_dummies) on all the data together
+    empty = pd.DataFrame({
+        feature: pd.Series([], dtype=int) if feature in numeric
+        else pd.Categorical([], categories=sorted(categories.get(feature, ())))
+        for feature in FEATURE_COLUMNS
+    })
+    return FeatureEncoder.fit(empty, drop_first=drop_first)
+
+
+def iter_blocks(files, encoder, le, block_rows=50_000, rng=None):
+    # (X dense unscaled, y) blocks of the spilled chunks, shuffled when rng is given
+    order = rng.permutation(len(files)) if rng is not None else range(len(files))
+    for i in order:
+        df_clean = load_clean(files[i])
+        if rng is not None:
+            df_clean = df_clean.iloc[rng.permutation(len(df_clean))]
+        X = encoder.transform(df_clean)
+        y = le.transform(np.asarray(df_clean["OZNAM"], dtype=object))
+        for start in range(0, len(df_clean), block_rows):
+            yield X[start:start + block_rows].toarray(), y[start:start + block_rows]
+
+
+def validation_score(mlp, scaler, files, encoder, le, block_rows=50_000):
+    correct = total = 0
+    for X, y in iter_blocks(files, encoder, le, block_rows):
+        correct += int((mlp.predict(scaler.transform(X)) == y).sum())
+        total += len(y)
+    return correct / total if total else 0.0
+
+
+def train_incremental(paths, epochs=10, patience=2, chunksize=500_000, block_rows=50_000,
+                      validation_fraction=0.2, cache_path="feature_cache.pkl", spill_dir=None, random_state=42,
+                      balance=None):
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmp:
+        print("cleaning and spilling chunks...")
+        feature_cache = FeatureCache(cache_path) if cache_path else None
+        with profiling.stage("train.spill"):
+            train_files, validation_files, categories, numeric, labels = spill_chunks(
+                paths, tmp, chunksize, feature_cache, validation_fraction, balance, random_state
+            )
+        if feature_cache is not None:
+            feature_cache.save()
+
+        # fixed classes and columns for all the partial_fit calls
+        le = LabelEncoder().fit(labels)
+        classes = np.arange(len(le.classes_))
+        encoder = fit_encoder(categories, numeric)
+
+        scaler = StandardScaler()
+        with profiling.stage("train.scale") as current:
+            for X, _ in iter_blocks(train_files, encoder, le, block_rows):
+                scaler.partial_fit(X)
+            current.rows = int(scaler.n_samples_seen_)
+
+        print("training MLP...")
+        rng = np.random.default_rng(random_state)
+        mlp = MLPClassifier(hidden_layer_sizes=(50, 25), random_state=random_state)
+        best_mlp, best_score, stale_epochs = None, -1.0, 0
+        for epoch in range(epochs):
+            with profiling.stage("train.epoch") as current:
+                rows = 0
+                for X, y in iter_blocks(train_files, encoder, le, block_rows, rng):
+                    mlp.partial_fit(scaler.transform(X), y, classes=classes)
+                    rows += len(y)
+                current.rows = rows
+            with profiling.stage("train.validation"):
+                score = validation_score(mlp, scaler, validation_files, encoder, le, block_rows)
+            print(f"epoch {epoch + 1}: validation score {score:.4f}")
+            if score > best_score:
+                best_mlp, best_score, stale_epochs = copy.deepcopy(mlp), score, 0
+            else:
+                stale_epochs += 1
+                if stale_epochs >= patience:
+                    break
+
+    print(f"training completed. best validation score: {best_score:.4f}")
+    artifacts = {"mlp": best_mlp, "scaler": scaler, "model_columns": encoder.columns, "le": le, "encoder": encoder}
+    return artifacts, best_score
+
+
+def main(path="MHMP_dopravni_prestupky_2023.csv", cache_path="feature_cache.pkl", show_plot=True, balance=None,
+         dedup=False):
+    # 1. load data and process them
+    print("loading and clearing data...")
+    with profiling.stage("train.load"):
+        df_clean = load_training_data(path, cache_path, balance)
+
+    artifacts, X_test, y_test = train_model(df_clean, dedup)
+
+    # 6. Export
+    export_model(**artifacts, observed=df_clean[FEATURE_COLUMNS])
+    show_report(artifacts["mlp"], artifacts["scaler"], artifacts["le"], X_test, y_test, show_plot)
+
+
+def main_incremental(paths, cache_path="feature_cache.pkl", epochs=10, chunksize=500_000, balance=None):
+    # python cli.py train MHMP_dopravni_prestupky_20*.csv --incremental
+    artifacts, _ = train_incremental(paths, epochs, chunksize=chunksize, cache_path=cache_path, balance=balance)
+    export_model(**artifacts)
+
+
+if __name__ == "__main__":
+    main()